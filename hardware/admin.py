@@ -1,18 +1,203 @@
-from django.contrib import admin
+import os
+from datetime import timedelta
+
+from django import forms
+from django.conf import settings
+from django.conf.urls import url
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.db.models import Q
+from django.http import HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils import timezone
 
 # Register your models here.
 from hardware import models
+from hardware.importer import FORMATS, parse, import_types
+
+
+class HardwareImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV or JSON catalog')
+    dry_run = forms.BooleanField(required=False, initial=True, help_text='Only show the changes, without saving them')
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        format = os.path.splitext(file.name)[1].lstrip('.').lower()
+        if format not in FORMATS:
+            raise forms.ValidationError('Upload a .csv or .json file')
+        try:
+            self.cleaned_data['rows'] = parse(file.read().decode('utf-8-sig'), format)
+        except ValueError as e:
+            raise forms.ValidationError(str(e))
+        return file
+
+
+class HardwareItemFormSet(forms.BaseInlineFormSet):
+
+    def clean(self):
+        super(HardwareItemFormSet, self).clean()
+        hw = self.instance
+        if not hw.pk or not hw.tracks_items or any(self.errors):
+            return
+        # The total count follows the items, it can't go below the items requested or out
+        deleted = len([form for form in self.deleted_forms if form.instance.pk])
+        added = len([form for form in self.extra_forms if form.has_changed() and form not in self.deleted_forms])
+        count = hw.items.count() - deleted + added
+        if count < hw.not_available_count:
+            raise forms.ValidationError('%d items are requested or out, can\'t go down to %d' % (
+                hw.not_available_count, count))
+
+    def save(self, commit=True):
+        if not commit:
+            return super(HardwareItemFormSet, self).save(commit)
+        # Items are added before the removed ones are deleted, so their count doesn't dip below the items out
+        new_objects = self.save_new_objects(commit)
+        return self.save_existing_objects(commit) + new_objects
+
+
+class HardwareItemInline(admin.TabularInline):
+    model = models.HardwareItem
+    formset = HardwareItemFormSet
+    fields = ['code']
+    extra = 1
 
 
 class HardwareTypeAdmin(admin.ModelAdmin):
 
-    list_display = ['name', 'description','total_count']
+    list_display = ['name', 'description', 'total_count', 'reserved_count', 'checked_out_count']
+    inlines = [HardwareItemInline]
+
+    def get_readonly_fields(self, request, obj=None):
+        # Types tracking every unit count their items instead
+        if obj and obj.tracks_items:
+            return ['total_count']
+        return []
+
+    def get_urls(self):
+        return [
+            url(r'^import/$', self.admin_site.admin_view(self.import_view), name='hardware_hardwaretype_import'),
+        ] + super(HardwareTypeAdmin, self).get_urls()
+
+    def import_view(self, request):
+        """Creates or updates the hardware types of an uploaded catalog, showing the changes first on a dry run"""
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+        form = HardwareImportForm(request.POST or None, request.FILES or None)
+        results, dry_run = None, True
+        if request.method == 'POST' and form.is_valid():
+            dry_run = form.cleaned_data['dry_run']
+            results = import_types(form.cleaned_data['rows'], dry_run=dry_run)
+            errors = sum(1 for result in results if result.action == 'error')
+            if errors:
+                messages.error(request, '%d invalid rows, nothing was imported' % errors)
+            elif not dry_run:
+                messages.success(request, 'Catalog imported: %d types created, %d updated' % (
+                    sum(1 for result in results if result.action == 'create'),
+                    sum(1 for result in results if result.action == 'update')))
+                return HttpResponseRedirect(reverse('admin:hardware_hardwaretype_changelist'))
+        return TemplateResponse(request, 'admin/hardware/hardwaretype/import.html', dict(
+            self.admin_site.each_context(request), opts=self.model._meta, form=form, results=results,
+            dry_run=dry_run, title='Import hardware catalog'))
+
+
+class RequestStatusFilter(admin.SimpleListFilter):
+    """Requests by state, each one served by an index on the state columns"""
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return [('pending', 'Pending'), ('expired', 'Expired'), ('active', 'Active'), ('returned', 'Returned')]
+
+    def queryset(self, request, queryset):
+        time_expired = timezone.now() - timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
+        if self.value() == 'pending':
+            return queryset.filter(pickup_time__isnull=True, expired_at__isnull=True, created_at__gte=time_expired)
+        if self.value() == 'expired':
+            return queryset.filter(Q(pickup_time__isnull=True, expired_at__isnull=False)
+                                   | Q(pickup_time__isnull=True, expired_at__isnull=True, created_at__lt=time_expired))
+        if self.value() == 'active':
+            return queryset.filter(return_time__isnull=True, pickup_time__isnull=False)
+        if self.value() == 'returned':
+            return queryset.filter(return_time__isnull=False)
+        return queryset
 
 
 class RequestAdmin(admin.ModelAdmin):
 
-    list_display = ['requestor', 'type', 'created_at', 'pickup_time', 'return_time', 'remaining_time']
+    list_display = ['requestor', 'type', 'created_at', 'pickup_time', 'return_time', 'remaining']
+    list_select_related = ['requestor', 'type']
+    list_filter = [RequestStatusFilter]
+    search_fields = ['^requestor__email', '^requestor__name', '^type__name']
+    raw_id_fields = ['requestor', 'borrowed_by', 'returned_to']
+    # Counting every request again for the 'show all' link is as slow as the page itself
+    show_full_result_count = False
+    actions = ['return_selected', 'cancel_selected']
+    # The stock counters, waitlists and rollups only follow the state changes made by the model methods
+    readonly_fields = ['requestor', 'type', 'item', 'created_at', 'pickup_time', 'return_time', 'expired_at']
+
+    def get_queryset(self, request):
+        return models.Request.with_remaining_time(super(RequestAdmin, self).get_queryset(request))
+
+    def get_actions(self, request):
+        # Requests are cancelled or returned with the actions below, never deleted
+        actions = super(RequestAdmin, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def has_add_permission(self, request):
+        # Hackers request hardware from the site, which checks the stock
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Requests are still deleted along with their hardware type
+        return obj is None and super(RequestAdmin, self).has_delete_permission(request)
+
+    def remaining(self, obj):
+        return max(obj.annotated_remaining_time, timedelta(0))
+    remaining.short_description = 'Remaining time'
+    remaining.admin_order_field = 'annotated_remaining_time'
+
+    def _report(self, request, ids, errors, action, done):
+        if errors:
+            self.message_user(request, 'Failed to %s: %s' % (action, ', '.join(
+                '%s: %s' % (k, v) for k, v in errors.items())), messages.ERROR)
+        else:
+            self.message_user(request, '%d requests %s' % (len(ids), done), messages.SUCCESS)
+
+    def return_selected(self, request, queryset):
+        ids = list(queryset.values_list('pk', flat=True))
+        self._report(request, ids, models.Request.bulk_return(ids, request.user), 'return', 'returned')
+    return_selected.short_description = 'Return selected requests'
+
+    def cancel_selected(self, request, queryset):
+        ids = list(queryset.values_list('pk', flat=True))
+        self._report(request, ids, models.Request.bulk_cancel(ids), 'cancel', 'cancelled')
+    cancel_selected.short_description = 'Cancel selected pending requests'
+
+
+class HardwareItemAdmin(admin.ModelAdmin):
+
+    list_display = ['code', 'type', 'created_at']
+    list_select_related = ['type']
+    list_filter = ['type']
+    search_fields = ['^code']
+
+    def get_readonly_fields(self, request, obj=None):
+        # The total count of the type was updated when the item was added
+        return ['type'] if obj else []
+
+
+class WaitlistEntryAdmin(admin.ModelAdmin):
+
+    list_display = ['user', 'type', 'created_at']
+    list_select_related = ['user', 'type']
+    search_fields = ['^user__email', '^user__name', '^type__name']
+    raw_id_fields = ['user']
+    ordering = ['type', 'pk']
 
 
 admin.site.register(models.HardwareType, HardwareTypeAdmin)
+admin.site.register(models.HardwareItem, HardwareItemAdmin)
 admin.site.register(models.Request, RequestAdmin)
+admin.site.register(models.WaitlistEntry, WaitlistEntryAdmin)
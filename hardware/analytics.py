@@ -0,0 +1,109 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Sum, Max
+
+from hardware.models import HardwareType, Request, UtilizationBucket
+
+# Fields of each bucket in the series
+SERIES_FIELDS = ['start'] + UtilizationBucket.COUNTERS + ['peak_checked_out']
+
+
+def summary(since=None):
+    """
+    Usage of every hardware type since the given time, or over the whole event, read from the rollups only:
+    counts, peak of items out at once, average loan duration and share of requests not picked up in time
+    """
+    buckets = UtilizationBucket.objects.all()
+    if since:
+        buckets = buckets.filter(start__gte=UtilizationBucket.bucket_start(since))
+    totals = {row['type_id']: row for row in buckets.order_by().values('type_id').annotate(
+        peak_checked_out=Max('peak_checked_out'), **{field: Sum(field) for field in UtilizationBucket.COUNTERS})}
+    result = []
+    for hw in HardwareType.objects.order_by('name').only('name', 'total_count'):
+        row = totals.get(hw.pk, {})
+        counts = {field: row.get(field) or 0 for field in UtilizationBucket.COUNTERS + ['peak_checked_out']}
+        collected = counts['picked_up'] + counts['expired']
+        counts.update({
+            'id': hw.pk,
+            'name': hw.name,
+            'total_count': hw.total_count,
+            'peak_utilization': round(float(counts['peak_checked_out']) / hw.total_count, 3)
+            if hw.total_count else None,
+            'avg_loan_minutes': round(counts['loan_seconds'] / 60.0 / counts['returned'], 1)
+            if counts['returned'] else None,
+            'no_show_rate': round(float(counts['expired']) / collected, 3) if collected else None,
+        })
+        result.append(counts)
+    return result
+
+
+def series(type_ids, since=None):
+    """Buckets of each of the types by id, in time order"""
+    buckets = UtilizationBucket.objects.filter(type_id__in=type_ids)
+    if since:
+        buckets = buckets.filter(start__gte=UtilizationBucket.bucket_start(since))
+    result = {pk: [] for pk in type_ids}
+    for row in buckets.order_by('start').values('type_id', *SERIES_FIELDS):
+        result[row.pop('type_id')].append(row)
+    return result
+
+
+def rebuild_buckets(chunk_size=2000, batch_size=500):
+    """
+    Recomputes every bucket from the requests, reading them in chunks by id. Cancelled requests are deleted, so
+    the cancellations counted by the live updates are kept instead. Returns the number of buckets written.
+    """
+    size = UtilizationBucket.bucket_size()
+    buckets = defaultdict(lambda: defaultdict(int))
+    # Type id to list of (time, +1 on pick up or -1 on return)
+    events = defaultdict(list)
+
+    with transaction.atomic():
+        # Lock every type so no request changes state while counting
+        list(HardwareType.objects.order_by('pk').select_for_update().values_list('pk', flat=True))
+        last_id = 0
+        while True:
+            chunk = list(Request.objects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'type_id', 'created_at', 'pickup_time', 'return_time', 'expired_at')[:chunk_size])
+            for _, type_id, created_at, pickup_time, return_time, expired_at in chunk:
+                buckets[(type_id, UtilizationBucket.bucket_start(created_at))]['requested'] += 1
+                if expired_at:
+                    buckets[(type_id, UtilizationBucket.bucket_start(expired_at))]['expired'] += 1
+                if pickup_time:
+                    buckets[(type_id, UtilizationBucket.bucket_start(pickup_time))]['picked_up'] += 1
+                    events[type_id].append((pickup_time, 1))
+                if pickup_time and return_time:
+                    bucket = buckets[(type_id, UtilizationBucket.bucket_start(return_time))]
+                    bucket['returned'] += 1
+                    bucket['loan_seconds'] += int((return_time - pickup_time).total_seconds())
+                    events[type_id].append((return_time, -1))
+            if len(chunk) < chunk_size:
+                break
+            last_id = chunk[-1][0]
+
+        # Cancelled requests are gone, their live counts are carried over into the current bucket size. Each one
+        # was also requested, counted in the bucket it was cancelled as its request time is lost.
+        for type_id, start, cancelled in UtilizationBucket.objects.filter(cancelled__gt=0) \
+                .values_list('type_id', 'start', 'cancelled'):
+            bucket = buckets[(type_id, UtilizationBucket.bucket_start(start))]
+            bucket['cancelled'] += cancelled
+            bucket['requested'] += cancelled
+
+        # Replays the pick ups and returns of each type for the most items out at once during each bucket
+        for type_id in set(type_id for type_id, _ in buckets):
+            timeline = sorted(events[type_id])
+            level, i = 0, 0
+            for start in sorted(start for pk, start in buckets if pk == type_id):
+                peak = level
+                while i < len(timeline) and timeline[i][0] < start + size:
+                    level += timeline[i][1]
+                    peak = max(peak, level)
+                    i += 1
+                buckets[(type_id, start)]['peak_checked_out'] = peak
+
+        UtilizationBucket.objects.all().delete()
+        UtilizationBucket.objects.bulk_create([UtilizationBucket(type_id=type_id, start=start, **counts)
+                                               for (type_id, start), counts in buckets.items()],
+                                              batch_size=batch_size)
+    return len(buckets)
@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 
 
 class HardwareConfig(AppConfig):
     name = 'hardware'
+
+    def ready(self):
+        # Connects the signal receivers
+        from hardware import caching, events, lookup, signals  # noqa: F401
+        from hardware import sweeper
+        # Only web processes sweep, management commands like migrate shouldn't start it
+        request_started.connect(sweeper.start, dispatch_uid='hardware_expiry_sweeper')
@@ -0,0 +1,147 @@
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.utils import timezone
+
+from hardware.lookup import hacker_index
+from hardware.models import HardwareType, Request, UtilizationBucket
+from user.models import User
+
+# Request states cycled through by the seeded requests
+STATES = ['pending', 'expired', 'active', 'returned']
+
+
+class Seed(object):
+    """Ids of the rows created by seed_event, so they can be measured and cleaned up"""
+
+    def __init__(self, admin, hacker_ids, type_ids):
+        self.admin = admin
+        self.hacker_ids = hacker_ids
+        self.type_ids = type_ids
+
+    @property
+    def hacker(self):
+        return User.objects.get(pk=self.hacker_ids[0])
+
+
+def seed_event(types, hackers, requests_per_hacker, prefix='bench', stock=None):
+    """
+    Creates a hardware admin, the given number of hardware types and hackers, and requests_per_hacker requests for
+    each hacker cycling through every request state. Rows are bulk created and named after the prefix. Each type
+    has stock items, or enough for every request if not given.
+    """
+    admin = User.objects.create_user('%s-admin@hardware.test' % prefix, '%s admin' % prefix, None)
+    admin.is_hardware_admin = True
+    admin.is_organizer = True
+    admin.save()
+
+    HardwareType.objects.bulk_create([
+        HardwareType(name='%s type %d' % (prefix, i), description='%s hardware' % prefix,
+                     total_count=hackers * requests_per_hacker if stock is None else stock)
+        for i in range(types)
+    ])
+    hw_types = list(HardwareType.objects.filter(name__startswith='%s type ' % prefix).order_by('pk'))
+
+    password = make_password(None)
+    User.objects.bulk_create([
+        User(email='%s-%d@hardware.test' % (prefix, i), name='%s hacker %d' % (prefix, i), password=password)
+        for i in range(hackers)
+    ])
+    hacker_ids = list(User.objects.filter(email__startswith='%s-' % prefix).exclude(pk=admin.pk)
+                      .order_by('pk').values_list('pk', flat=True))
+
+    now = timezone.now()
+    requests = []
+    for i, hacker_id in enumerate(hacker_ids):
+        for j in range(requests_per_hacker):
+            state = STATES[j % len(STATES)]
+            r = Request(type=hw_types[(i + j) % len(hw_types)], requestor_id=hacker_id)
+            if state == 'expired':
+                r.expired_at = now
+            if state in ('active', 'returned'):
+                r.pickup_time = now
+                r.borrowed_by = admin
+            if state == 'returned':
+                r.return_time = now
+                r.returned_to = admin
+            requests.append(r)
+    Request.objects.bulk_create(requests, batch_size=500)
+
+    # created_at is set on insert, so expired requests are backdated afterwards
+    Request.objects.filter(requestor_id__in=hacker_ids, expired_at__isnull=False) \
+        .update(created_at=now - timedelta(minutes=settings.HARDWARE_REQUEST_TIME + 1))
+    for hw in HardwareType.objects.filter(pk__in=[hw.pk for hw in hw_types]).with_request_counts():
+        HardwareType.objects.filter(pk=hw.pk).update(reserved_count=hw.counted_reserved,
+                                                     checked_out_count=hw.counted_checked_out)
+
+    # Rollups of a whole 48 hour event, so the analytics pages read as many buckets as they would at its end
+    size = UtilizationBucket.bucket_size()
+    start = UtilizationBucket.bucket_start(now)
+    UtilizationBucket.objects.bulk_create([
+        UtilizationBucket(type=hw, start=start - size * i, requested=2, picked_up=1, returned=1, expired=1,
+                          loan_seconds=3600, peak_checked_out=1)
+        for hw in hw_types for i in range(int(48 * 3600 / size.total_seconds()))
+    ], batch_size=500)
+    # Bulk created hackers send no post_save, the lookup index is reloaded to find them
+    hacker_index().load()
+    return Seed(admin, hacker_ids, [hw.pk for hw in hw_types])
+
+
+def clean_event(prefix='bench'):
+    """Deletes the rows created by seed_event with the given prefix"""
+    users = User.objects.filter(email__startswith='%s-' % prefix, email__endswith='@hardware.test')
+    Request.objects.filter(requestor__in=users).delete()
+    HardwareType.objects.filter(name__startswith='%s type ' % prefix).delete()
+    users.delete()
+
+
+def page_url(name, kwargs, query):
+    return reverse(name, kwargs=kwargs) + ('?' + query if query else '')
+
+
+def fetch(client, url):
+    """Gets the page with the client, reading the whole body of streamed ones so all their queries run"""
+    response = client.get(url)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def percentile(values, p):
+    """Nearest rank percentile p (0-100) of the values"""
+    values = sorted(values)
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+def pages(seed):
+    """
+    Hardware pages, as (url name, url kwargs, query string, whether it's seen by the admin or the hacker). The
+    event stream is left out as it never finishes, and the item return as it only takes a POST. The export is
+    streamed with one query per chunk of rows, so only its page makes a fixed number of queries.
+    """
+    hacker = {'id': seed.hacker_ids[0]}
+    hacker_user = seed.hacker
+    selected = '&'.join('selected=%d' % pk for pk in seed.type_ids[:50])
+    return [
+        ('hw_pickupreturn', {}, '', True),
+        ('hw_listall', {}, '', True),
+        ('hwad_active', {}, '', True),
+        ('hw_pickup', hacker, '', True),
+        ('hw_return', hacker, '', True),
+        ('hw_requestor', hacker, '', True),
+        ('hw_api', {}, '', False),
+        ('hw_list', {}, '', False),
+        ('hw_selectamount', {}, selected, False),
+        ('hw_request', {}, '', False),
+        ('hw_active', {}, '', False),
+        ('hw_waitlist', {}, '', False),
+        ('hw_lookup', {}, urlencode({'q': hacker_user.name}), True),
+        ('hw_scan', {}, urlencode({'code': hacker_user.email}), True),
+        ('hw_export', {}, '', True),
+        ('hw_analytics', {}, '', True),
+        ('hw_analytics_api', {}, 'type=%d' % seed.type_ids[0], True),
+    ]
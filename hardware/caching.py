@@ -0,0 +1,99 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from hardware.models import Request, HardwareType
+from hardware.signals import requests_changed
+
+TAB_COUNTS_KEY = 'hardware_tab_counts_%s'
+INVENTORY_VERSION_KEY = 'hardware_inventory_version'
+INVENTORY_KEY = 'hardware_inventory_%s'
+RATE_KEY = 'hardware_rate_%s_%s'
+
+
+def cache_timeout():
+    # Upper bound for staleness if an invalidation is missed, e.g. with a cache not shared between processes
+    return getattr(settings, 'HARDWARE_CACHE_TIMEOUT', 300)
+
+
+def request_rate():
+    """Hardware requests a hacker can submit per window, as a tuple of the requests and seconds. None if unlimited."""
+    return getattr(settings, 'HARDWARE_REQUEST_RATE', (10, 60))
+
+
+def tab_counts(user_id):
+    """Pending and active request counts of the user, cached until any of their requests changes"""
+    key = TAB_COUNTS_KEY % user_id
+    counts = cache.get(key)
+    if counts is None:
+        counts = Request.count_by_state(user_id)
+        cache.set(key, counts, cache_timeout())
+    return counts
+
+
+@receiver(requests_changed)
+def invalidate_tab_counts(sender, user_ids, **kwargs):
+    cache.delete_many([TAB_COUNTS_KEY % user_id for user_id in user_ids])
+
+
+def _inventory_version():
+    version = cache.get(INVENTORY_VERSION_KEY)
+    if version is None:
+        cache.add(INVENTORY_VERSION_KEY, 1, None)
+        version = cache.get(INVENTORY_VERSION_KEY, 1)
+    return version
+
+
+def inventory():
+    """
+    Availability snapshot of every hardware type, built with a single query and cached until any request or
+    type changes. Returns a dict with the items, the time it was built and an etag of the items.
+    """
+    key = INVENTORY_KEY % _inventory_version()
+    snapshot = cache.get(key)
+    if snapshot is None:
+        items = [{'id': hw.pk, 'name': hw.name, 'description': hw.description, 'total': hw.total_count, 'url': hw.url,
+                  'available': hw.available_count}
+                 for hw in HardwareType.objects.order_by('pk')]
+        etag = hashlib.md5(json.dumps(items, cls=DjangoJSONEncoder, sort_keys=True).encode('utf-8')).hexdigest()
+        snapshot = {'items': items, 'update_time': timezone.now(), 'etag': etag}
+        cache.set(key, snapshot, cache_timeout())
+    return snapshot
+
+
+# Snapshots are versioned instead of deleted, so a snapshot built concurrently with a change can't outlive it
+@receiver(requests_changed)
+@receiver(post_save, sender=HardwareType)
+@receiver(post_delete, sender=HardwareType)
+def invalidate_inventory(sender, **kwargs):
+    try:
+        cache.incr(INVENTORY_VERSION_KEY)
+    except ValueError:
+        cache.add(INVENTORY_VERSION_KEY, 1, None)
+
+
+def rate_limited(user_id):
+    """
+    Counts a hardware request of the user, returns whether they went over HARDWARE_REQUEST_RATE, a tuple of the
+    requests allowed and the window in seconds. Windows are fixed, so up to twice the rate can get through across
+    two of them.
+    """
+    rate = request_rate()
+    if not rate:
+        return False
+    limit, window = rate
+    key = RATE_KEY % (user_id, int(time.time() // window))
+    cache.add(key, 0, window)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # Evicted between the add and the incr
+        count = 1
+    return count > limit
@@ -0,0 +1,99 @@
+import json
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from hardware.models import HardwareType, Request
+from hardware.signals import requests_changed
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class Subscription(object):
+    """Events waiting to be sent to one stream client"""
+
+    def __init__(self, user_id=None, max_events=100):
+        self.user_id = user_id
+        self.events = queue.Queue(maxsize=max_events)
+
+    def put(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # Slow client, it will be up to date again with the next events
+            pass
+
+    def get(self, timeout):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LocalBroker(object):
+    """
+    In-process broker, only reaches clients connected to the same process. Deployments with several web processes
+    need a broker shared between them, set with HARDWARE_EVENT_BROKER.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, user_id=None):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def has_subscribers(self, user_id=None):
+        with self._lock:
+            return any(user_id is None or s.user_id == user_id for s in self._subscriptions)
+
+    def publish(self, name, data, user_id=None):
+        """Sends the event to every subscriber, or only to the ones of user_id if given"""
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions if user_id is None or s.user_id == user_id]
+        for subscription in subscriptions:
+            subscription.put((name, data))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'HARDWARE_EVENT_BROKER', 'hardware.events.LocalBroker'))()
+    return _broker
+
+
+def format_event(name, data):
+    return 'event: %s\ndata: %s\n\n' % (name, json.dumps(data, cls=DjangoJSONEncoder))
+
+
+@receiver(requests_changed)
+def publish_changes(sender, type_ids, user_ids, **kwargs):
+    """Pushes the new availability of the types changed, and the reservations of the users affected"""
+    broker = get_broker()
+    if not broker.has_subscribers():
+        return
+    broker.publish('availability', [{'id': hw.pk, 'available': hw.available_count, 'total': hw.total_count}
+                                    for hw in HardwareType.objects.filter(pk__in=type_ids)])
+    for user_id in user_ids:
+        if broker.has_subscribers(user_id):
+            broker.publish('reservations', [{'id': r.pk, 'name': r.type.name, 'expires_at': r.expires_at}
+                                            for r in Request.pending_objects(user_id).select_related('type')],
+                           user_id=user_id)
@@ -0,0 +1,93 @@
+import csv
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import six, timezone
+
+from hardware.models import Request
+
+# Exported columns, as (header, lookup on the request)
+COLUMNS = [
+    ('id', 'id'),
+    ('hardware', 'type__name'),
+    ('item', 'item__code'),
+    ('requestor_name', 'requestor__name'),
+    ('requestor_email', 'requestor__email'),
+    ('requested_at', 'created_at'),
+    ('expired_at', 'expired_at'),
+    ('pickup_time', 'pickup_time'),
+    ('borrowed_by', 'borrowed_by__email'),
+    ('return_time', 'return_time'),
+    ('returned_to', 'returned_to__email'),
+]
+HEADERS = [header for header, _ in COLUMNS] + ['status']
+_INDEX = {header: i for i, header in enumerate(HEADERS)}
+
+
+def _status(row, time_expired):
+    if row[_INDEX['return_time']]:
+        return 'returned'
+    if row[_INDEX['pickup_time']]:
+        return 'active'
+    if row[_INDEX['expired_at']] or row[_INDEX['requested_at']] < time_expired:
+        return 'expired'
+    return 'pending'
+
+
+def loan_rows(unreturned=False, chunk_size=2000):
+    """
+    Every request as a tuple of the HEADERS values, read in chunks of chunk_size rows by id so memory stays flat
+    however many there are. Only items picked up and not returned yet if unreturned.
+    """
+    queryset = Request.objects.all()
+    if unreturned:
+        queryset = queryset.filter(pickup_time__isnull=False, return_time__isnull=True)
+    time_expired = timezone.now() - timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id).order_by('id')
+                     .values_list(*[lookup for _, lookup in COLUMNS])[:chunk_size])
+        for row in chunk:
+            yield row + (_status(row, time_expired),)
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1][0]
+
+
+class Echo(object):
+    """File-like object that hands back what is written to it, so csv lines can be yielded one by one"""
+
+    def write(self, value):
+        return value
+
+
+def _text(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _csv_text(value):
+    value = _text(value)
+    # The csv module of Python 2 only writes bytes
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADERS)
+    for row in rows:
+        yield writer.writerow([_csv_text(value) for value in row])
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(HEADERS, [_text(value) for value in row]))) + '\n'
+
+
+# Format name to (line generator, content type, file extension)
+FORMATS = {
+    'csv': (csv_lines, 'text/csv', 'csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson', 'ndjson'),
+}
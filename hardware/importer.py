@@ -0,0 +1,145 @@
+import csv
+import io
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, When, Value
+
+from hardware.models import HardwareType, WaitlistEntry
+from hardware.signals import notify_requests_changed
+
+# Columns of the catalog, name identifies the type to update
+FIELDS = ['name', 'description', 'total_count', 'url', 'max_per_user']
+FORMATS = ['csv', 'json']
+
+
+class ImportRow(object):
+    """Outcome of importing one row: its action (create, update, unchanged or error), changes and errors"""
+
+    def __init__(self, number, name):
+        self.number = number
+        self.name = name
+        self.action = None
+        # Field name to (old value, new value)
+        self.changes = {}
+        self.errors = []
+        self.instance = None
+
+    def __str__(self):
+        if self.action == 'error':
+            return 'Row %d %s: %s' % (self.number, self.name or '-', '; '.join(self.errors))
+        if self.action == 'update':
+            return '~ %s: %s' % (self.name, ', '.join('%s %r -> %r' % (field, old, new)
+                                                      for field, (old, new) in sorted(self.changes.items())))
+        return '%s %s' % ('+' if self.action == 'create' else '=', self.name)
+
+
+def parse(text, format):
+    """Rows of a CSV with a header line, or of a JSON list of objects, as dicts"""
+    if format == 'json':
+        rows = json.loads(text)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('JSON catalogs must be a list of objects')
+        return rows
+    if format == 'csv':
+        return list(csv.DictReader(io.StringIO(text)))
+    raise ValueError('Unknown format %s, use one of %s' % (format, ', '.join(FORMATS)))
+
+
+def _check(number, row, existing):
+    """Validates a parsed row against the current type with its name, if any"""
+    values = {field: row[field] for field in FIELDS if row.get(field) is not None}
+    for field in ('url', 'max_per_user'):
+        if values.get(field) == '':
+            values[field] = None
+    result = ImportRow(number, values.get('name'))
+    if not values.get('name'):
+        result.action = 'error'
+        result.errors.append('name is required')
+        return result
+
+    old = existing.get(values['name'])
+    hw = HardwareType(**{field: getattr(old, field) for field in FIELDS}) if old else HardwareType()
+    for field, value in values.items():
+        setattr(hw, field, value)
+    try:
+        hw.clean_fields(exclude=['reserved_count', 'checked_out_count'])
+    except ValidationError as e:
+        result.errors.extend('%s: %s' % (field, ' '.join(messages)) for field, messages in e.message_dict.items())
+    if not result.errors and hw.total_count < 0:
+        result.errors.append('total_count: can\'t be negative')
+    if not result.errors and old and old.tracks_items and hw.total_count != old.total_count:
+        result.errors.append('total_count: counted from its %d tracked items' % old.total_count)
+    if not result.errors and old and hw.total_count < old.not_available_count:
+        result.errors.append('total_count: %d items are requested or out, can\'t go down to %d' % (
+            old.not_available_count, hw.total_count))
+    if result.errors:
+        result.action = 'error'
+        return result
+
+    if old:
+        hw.pk = old.pk
+        result.changes = {field: (getattr(old, field), getattr(hw, field)) for field in FIELDS
+                          if getattr(old, field) != getattr(hw, field)}
+        result.action = 'update' if result.changes else 'unchanged'
+    else:
+        result.action = 'create'
+    result.instance = hw
+    return result
+
+
+def _update(results, batch_size):
+    """Writes the changes of the updated rows with one UPDATE per batch and changed field set"""
+    for i in range(0, len(results), batch_size):
+        batch = results[i:i + batch_size]
+        fields = set(field for result in batch for field in result.changes)
+        HardwareType.objects.filter(pk__in=[result.instance.pk for result in batch]).update(**{
+            field: Case(*[When(pk=result.instance.pk, then=Value(getattr(result.instance, field)))
+                          for result in batch], output_field=HardwareType._meta.get_field(field))
+            for field in fields
+        })
+
+
+def import_types(rows, dry_run=False, batch_size=200):
+    """
+    Creates or updates the hardware types of the parsed rows, matching them by name. Only the columns present
+    in a row are changed. Nothing is written if any row is invalid or on a dry run. Returns the ImportRow of
+    each row.
+    """
+    names = [row.get('name') for row in rows if row.get('name')]
+
+    with transaction.atomic():
+        existing = {}
+        for i in range(0, len(names), batch_size):
+            queryset = HardwareType.objects.filter(name__in=names[i:i + batch_size]).order_by('pk')
+            # Rows are locked so no request can take the items a lowered total_count is checked against
+            if not dry_run:
+                queryset = queryset.select_for_update()
+            existing.update((hw.name, hw) for hw in queryset)
+
+        results, seen = [], set()
+        for number, row in enumerate(rows, 1):
+            result = _check(number, row, existing)
+            if result.name in seen:
+                result.action = 'error'
+                result.errors.append('name appears more than once')
+            seen.add(result.name)
+            results.append(result)
+
+        if dry_run or any(result.action == 'error' for result in results):
+            return results
+
+        created = [result.instance for result in results if result.action == 'create']
+        HardwareType.objects.bulk_create(created, batch_size=batch_size)
+        updated = [result for result in results if result.action == 'update']
+        _update(updated, batch_size)
+        if created or updated:
+            # Bulk writes send no post_save, the cached inventory and the live availability are refreshed here.
+            # Only PostgreSQL sets the ids of bulk created rows, they are read back by name.
+            created_ids = [pk for i in range(0, len(created), batch_size) for pk in HardwareType.objects.filter(
+                name__in=[hw.name for hw in created[i:i + batch_size]]).values_list('pk', flat=True)]
+            notify_requests_changed(HardwareType, created_ids + [result.instance.pk for result in updated], [])
+        # Types whose total count was raised hand the new items to their waiters first
+        WaitlistEntry.promote([result.instance.pk for result in updated if 'total_count' in result.changes])
+    return results
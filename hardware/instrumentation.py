@@ -0,0 +1,156 @@
+import functools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in milliseconds of the histogram buckets, the last one catches everything slower
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+_enabled = None
+
+
+def enabled():
+    # Read once, settings are too slow to look up on every instrumented call
+    global _enabled
+    if _enabled is None:
+        _enabled = getattr(settings, 'HARDWARE_INSTRUMENTATION', False)
+    return _enabled
+
+
+@receiver(setting_changed)
+def reset_enabled(setting, **kwargs):
+    global _enabled
+    if setting == 'HARDWARE_INSTRUMENTATION':
+        _enabled = None
+
+
+class Timing(object):
+    """Histogram of the durations of a view or method, with the SQL and render totals of views"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.render_ms = 0.0
+
+    def add(self, ms, sql_count=0, sql_ms=0.0, render_ms=0.0):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[sum(1 for bound in BUCKETS if ms > bound)] += 1
+        self.sql_count += sql_count
+        self.sql_ms += sql_ms
+        self.render_ms += render_ms
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 2) if self.count else 0,
+            'max_ms': round(self.max_ms, 2),
+            'histogram': dict(zip(['<=%d' % bound for bound in BUCKETS] + ['>%d' % BUCKETS[-1]], self.buckets)),
+            'avg_sql_count': round(float(self.sql_count) / self.count, 2) if self.count else 0,
+            'avg_sql_ms': round(self.sql_ms / self.count, 2) if self.count else 0,
+            'avg_render_ms': round(self.render_ms / self.count, 2) if self.count else 0,
+        }
+
+
+class Stats(object):
+    """Timings of this process, by view url name or method"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+
+    def record(self, name, ms, **kwargs):
+        with self._lock:
+            self._timings.setdefault(name, Timing()).add(ms, **kwargs)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: timing.as_dict() for name, timing in self._timings.items()}
+
+    def reset(self):
+        with self._lock:
+            self._timings = {}
+
+
+stats = Stats()
+
+
+def timed(name):
+    """Records the duration of every call of the decorated function under name, if instrumentation is enabled"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.record(name, (time.time() - start) * 1000)
+
+        return wrapper
+
+    return decorator
+
+
+class HardwareInstrumentationMiddleware(MiddlewareMixin):
+    """
+    Records the total, SQL and render time and the number of queries of every hardware view. Removed from the
+    middleware chain on start up unless HARDWARE_INSTRUMENTATION is enabled.
+    """
+
+    def __init__(self, get_response=None):
+        if not enabled():
+            raise MiddlewareNotUsed()
+        super(HardwareInstrumentationMiddleware, self).__init__(get_response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not view_func.__module__.startswith('hardware.'):
+            return None
+        request._hw_instrumentation = {
+            'name': request.resolver_match.url_name or view_func.__name__,
+            'start': time.time(),
+            'debug_cursor': connection.force_debug_cursor,
+            'initial_queries': len(connection.queries_log),
+        }
+        # Logs the queries even without DEBUG, the log is cleared at the start of every request
+        connection.force_debug_cursor = True
+        return None
+
+    def process_template_response(self, request, response):
+        if hasattr(request, '_hw_instrumentation'):
+            request._hw_instrumentation['rendering'] = time.time()
+        return response
+
+    def process_response(self, request, response):
+        data = getattr(request, '_hw_instrumentation', None)
+        if data is None:
+            return response
+        end = time.time()
+        connection.force_debug_cursor = data['debug_cursor']
+        queries = list(connection.queries_log)[data['initial_queries']:]
+        ms = (end - data['start']) * 1000
+        sql_ms = sum(float(query['time']) for query in queries) * 1000
+        render_ms = (end - data['rendering']) * 1000 if 'rendering' in data else 0.0
+        stats.record(data['name'], ms, sql_count=len(queries), sql_ms=sql_ms, render_ms=render_ms)
+        logger.info('%s %s took %.1fms: %d queries in %.1fms, rendered in %.1fms', request.method, data['name'],
+                    ms, len(queries), sql_ms, render_ms,
+                    extra={'view': data['name'], 'duration_ms': ms, 'sql_count': len(queries), 'sql_ms': sql_ms,
+                           'render_ms': render_ms})
+        return response
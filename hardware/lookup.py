@@ -0,0 +1,130 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from user.models import User
+
+
+def hackers():
+    return User.objects.filter(is_volunteer=False, is_director=False, is_active=True, is_organizer=False)
+
+
+def is_hacker(user):
+    return not user.is_volunteer and not user.is_director and user.is_active and not user.is_organizer
+
+
+def find_user(code):
+    """User identified by a scanned code, either their id or their email"""
+    code = code.strip()
+    lookup = Q(email__iexact=code)
+    if code.isdigit():
+        lookup |= Q(pk=code)
+    return User.objects.filter(lookup).first() if code else None
+
+
+class HackerIndex(object):
+    """
+    In-memory sorted index of the hackers by email and by each word of their name, so prefix lookups don't scan
+    the users table. Changes made in this process are applied as they happen, changes made by other processes are
+    picked up by reloading it every HARDWARE_LOOKUP_REFRESH seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Sorted (key, user id) pairs
+        self._keys = []
+        # User id to (name, email)
+        self._users = {}
+        self._loaded_at = None
+
+    @staticmethod
+    def _keys_for(user_id, name, email):
+        words = set((name or '').lower().split())
+        words.add((email or '').lower())
+        return [(word, user_id) for word in words if word]
+
+    def _expired(self):
+        refresh = getattr(settings, 'HARDWARE_LOOKUP_REFRESH', 300)
+        return self._loaded_at is None or time.time() - self._loaded_at > refresh
+
+    def load(self):
+        users, keys = {}, []
+        for user_id, name, email in hackers().values_list('pk', 'name', 'email').iterator():
+            users[user_id] = (name, email)
+            keys.extend(self._keys_for(user_id, name, email))
+        keys.sort()
+        with self._lock:
+            self._users, self._keys, self._loaded_at = users, keys, time.time()
+
+    def _remove(self, user_id):
+        if user_id not in self._users:
+            return
+        for key in self._keys_for(user_id, *self._users.pop(user_id)):
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def update(self, user):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._remove(user.pk)
+            if is_hacker(user):
+                self._users[user.pk] = (user.name, user.email)
+                for key in self._keys_for(user.pk, user.name, user.email):
+                    bisect.insort(self._keys, key)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def search(self, query, limit=10):
+        """
+        Hackers with a name word or email starting with every word of the query, as dicts with their id, name
+        and email. At most limit of them.
+        """
+        words = query.lower().split()
+        if not words:
+            return []
+        if self._expired():
+            self.load()
+        # Walk the matches of the longest word, the most selective one, checking the rest on each user
+        longest = max(words, key=len)
+        results, seen = [], set()
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (longest,))
+            while i < len(self._keys) and len(results) < limit:
+                key, user_id = self._keys[i]
+                i += 1
+                if not key.startswith(longest):
+                    break
+                if user_id in seen:
+                    continue
+                seen.add(user_id)
+                name, email = self._users[user_id]
+                user_keys = [k for k, _ in self._keys_for(user_id, name, email)]
+                if all(any(k.startswith(word) for k in user_keys) for word in words):
+                    results.append({'id': user_id, 'name': name, 'email': email})
+        return results
+
+
+_index = HackerIndex()
+
+
+def hacker_index():
+    return _index
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    _index.update(instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    _index.remove(instance.pk)
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from hardware.benchmark import pages, page_url, fetch
+from hardware.management.commands.hardware_benchmark import seeded_event
+
+
+class Command(BaseCommand):
+    help = 'Checks that the number of queries of each hardware page stays fixed as the number of rows grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--small', type=int, default=4,
+                            help='Requests per hacker of the small event (default 4)')
+        parser.add_argument('--large', type=int, default=200,
+                            help='Requests per hacker of the large event (default 200)')
+        parser.add_argument('--max-queries', type=int, default=12, dest='max_queries',
+                            help='Most queries any page can make (default 12)')
+
+    def measure(self, requests_per_hacker):
+        """Query count of each page on a seeded event, rolled back afterwards"""
+        counts = []
+        with seeded_event(types=60, hackers=60, requests_per_hacker=requests_per_hacker, prefix='querycount') as \
+                (seed, admin, hacker):
+            for name, kwargs, query, as_admin in pages(seed):
+                client = admin if as_admin else hacker
+                with CaptureQueriesContext(connection) as queries:
+                    response = fetch(client, page_url(name, kwargs, query))
+                if response.status_code != 200:
+                    raise CommandError('%s answered %d' % (name, response.status_code))
+                counts.append((name, len(queries.captured_queries), response.streaming))
+        return counts
+
+    def handle(self, *args, **options):
+        small = self.measure(options['small'])
+        large = self.measure(options['large'])
+
+        failures = []
+        for (name, count, streaming), (_, large_count, _) in zip(small, large):
+            problem = ''
+            # Streamed pages read their rows in chunks, one query each
+            if large_count != count and not streaming:
+                problem = 'grows with the rows'
+            elif count > options['max_queries']:
+                problem = 'over the budget'
+            if problem:
+                failures.append(name)
+            self.stdout.write('%s: %d -> %d queries %s' % (name, count, large_count, problem))
+        if failures:
+            raise CommandError('Hardware pages with too many queries: ' + ', '.join(failures))
+        self.stdout.write(self.style.SUCCESS('All hardware pages make a fixed number of queries'))
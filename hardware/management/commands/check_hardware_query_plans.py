@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from hardware.models import Request
+
+
+def hot_querysets():
+    return [
+        ('pending_objects', Request.pending_objects(0)),
+        ('historic_objects', Request.historic_objects(0).order_by('-id')),
+        ('active_objects', Request.active_objects(0)),
+        ('active_overall', Request.active_overall().order_by('-pickup_time', '-id')),
+        ('overdue_objects', Request.overdue_objects()),
+    ]
+
+
+def explain(queryset):
+    """
+    Plan of the queryset on PostgreSQL or SQLite as a list of lines, and whether it scans the whole requests
+    table. Must run in a transaction on PostgreSQL.
+    """
+    sql, params = queryset.query.get_compiler(connection=connection).as_sql()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Tables are usually too small for the planner to prefer an index, so it must be forced
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            plan = [row[0] for row in cursor.fetchall()]
+            return plan, any('Seq Scan on %s' % Request._meta.db_table in line for line in plan)
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = [row[-1] for row in cursor.fetchall()]
+        # Older SQLite versions say 'SCAN TABLE x' instead of 'SCAN x'
+        full_scans = ('SCAN %s' % Request._meta.db_table, 'SCAN TABLE %s' % Request._meta.db_table)
+        return plan, any(line in full_scans for line in plan)
+
+
+class Command(BaseCommand):
+    help = 'Checks that the hot hardware request queries use an index instead of scanning the whole table'
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            raise CommandError('Query plans can only be checked on PostgreSQL and SQLite')
+
+        scans = []
+        with transaction.atomic():
+            for name, queryset in hot_querysets():
+                plan, full_scan = explain(queryset)
+                self.stdout.write('%s%s' % (name, ': FULL SCAN' if full_scan else ''))
+                for line in plan:
+                    self.stdout.write('    ' + line)
+                if full_scan:
+                    scans.append(name)
+        if scans:
+            raise CommandError('Hot queries scanning the whole requests table: ' + ', '.join(scans))
+        self.stdout.write(self.style.SUCCESS('All hot hardware queries use an index'))
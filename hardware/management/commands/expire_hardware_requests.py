@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from hardware.models import Request
+
+
+class Command(BaseCommand):
+    help = 'Expires the hardware requests that have not been picked up in time, releasing their items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+                            help='Requests expired per transaction')
+        parser.add_argument('--interval', type=int, default=0, dest='interval',
+                            help='Keep running, sweeping every given number of seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            expired = Request.expire_overdue(batch_size=options['batch_size'])
+            self.stdout.write('Expired %d hardware requests' % expired)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
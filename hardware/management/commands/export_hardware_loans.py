@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from hardware.export import FORMATS, loan_rows
+
+
+class Command(BaseCommand):
+    help = 'Exports every hardware request with its hacker, type and admins, streaming them as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help='Output format (default csv)')
+        parser.add_argument('--output', help='File to write the export to, printed if not given')
+        parser.add_argument('--unreturned', action='store_true',
+                            help='Only export items picked up and not returned yet')
+        parser.add_argument('--chunk-size', type=int, default=2000, dest='chunk_size',
+                            help='Requests read from the database at once (default 2000)')
+
+    def handle(self, *args, **options):
+        lines = FORMATS[options['format']][0](loan_rows(options['unreturned'], options['chunk_size']))
+        output = open(options['output'], 'w') if options['output'] else sys.stdout
+        try:
+            for line in lines:
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,128 @@
+import json
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_started
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from hardware.benchmark import seed_event, pages, page_url, percentile, fetch
+from hardware.caching import invalidate_inventory, invalidate_tab_counts
+from hardware.lookup import hacker_index
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, the command refuses to run
+    tracemalloc = None
+
+
+@contextmanager
+def seeded_event(types, hackers, requests_per_hacker, prefix='bench'):
+    """
+    Seeds an event inside a transaction that is rolled back on exit. Yields the seed and test clients logged in
+    as its admin and as its first hacker.
+    """
+    # The expiry sweeper would run in another thread, outside of the rolled back transaction
+    request_started.disconnect(dispatch_uid='hardware_expiry_sweeper')
+    with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+        seed = seed_event(types, hackers, requests_per_hacker, prefix)
+        admin, hacker = Client(), Client()
+        admin.force_login(seed.admin)
+        hacker.force_login(seed.hacker)
+        user_ids = [seed.admin.pk] + seed.hacker_ids
+        # Cached tab counts and inventory of a previous run would hide their queries
+        invalidate_inventory(None)
+        invalidate_tab_counts(None, user_ids=user_ids)
+        try:
+            yield seed, admin, hacker
+        finally:
+            transaction.set_rollback(True)
+    # Rolled back rows must not stay cached
+    invalidate_inventory(None)
+    invalidate_tab_counts(None, user_ids=user_ids)
+    hacker_index().load()
+
+
+class Command(BaseCommand):
+    help = 'Measures the queries, latency and memory of every hardware page on seeded events of growing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--types', type=int, default=20, help='Hardware types of the smallest event (default 20)')
+        parser.add_argument('--hackers', type=int, default=50, help='Hackers of the smallest event (default 50)')
+        parser.add_argument('--requests', type=int, default=4,
+                            help='Requests per hacker of the smallest event, split across every state (default 4)')
+        parser.add_argument('--scales', default='1,5,25',
+                            help='Comma separated multipliers of the event size to run (default 1,5,25)')
+        parser.add_argument('--repeat', type=int, default=20, help='Times each page is fetched (default 20)')
+        parser.add_argument('--output', help='File to write the JSON report to, printed if not given')
+
+    def measure_page(self, client, url, repeat):
+        # The first fetch runs with empty caches, so its queries are the ones that count
+        with CaptureQueriesContext(connection) as queries:
+            response = fetch(client, url)
+        # Every request clears the query log, so they are counted right away
+        query_count = len(queries.captured_queries)
+        if response.status_code != 200:
+            raise CommandError('%s answered %d' % (url, response.status_code))
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            fetch(client, url)
+            timings.append((time.time() - start) * 1000)
+        # Measured apart, tracing allocations slows everything down
+        tracemalloc.start()
+        try:
+            fetch(client, url)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            'url': url,
+            'queries': query_count,
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'max_ms': round(max(timings), 2),
+            'peak_memory_kb': round(peak / 1024.0, 1),
+        }
+
+    def handle(self, *args, **options):
+        if tracemalloc is None:
+            raise CommandError('Measuring memory needs tracemalloc, run the benchmark on Python 3.4 or newer')
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError('Scales must be comma separated integers')
+        repeat = max(options['repeat'], 1)
+
+        events = []
+        for scale in scales:
+            size = {'types': options['types'] * scale, 'hackers': options['hackers'] * scale,
+                    'requests_per_hacker': options['requests']}
+            self.stderr.write('Seeding %(types)d types, %(hackers)d hackers, %(requests_per_hacker)d requests each' %
+                              size)
+            with seeded_event(prefix='benchmark', **size) as (seed, admin, hacker):
+                results = {}
+                for name, kwargs, query, as_admin in pages(seed):
+                    results[name] = self.measure_page(admin if as_admin else hacker, page_url(name, kwargs, query),
+                                                      repeat)
+                    self.stderr.write('  %s: %d queries, p50 %.2fms, p99 %.2fms' % (
+                        name, results[name]['queries'], results[name]['p50_ms'], results[name]['p99_ms']))
+            size['requests'] = size['hackers'] * size['requests_per_hacker']
+            events.append(dict(size, pages=results))
+
+        report = json.dumps({
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'repeat': repeat,
+            'events': events,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+            self.stderr.write(self.style.SUCCESS('Report written to %s' % options['output']))
+        else:
+            self.stdout.write(report)
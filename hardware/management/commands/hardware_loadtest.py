@@ -0,0 +1,178 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F
+
+from hardware.benchmark import seed_event, clean_event, percentile
+from hardware.models import HardwareType, Request
+from user.models import User
+
+PREFIX = 'loadtest'
+OPERATIONS = ['request', 'pickup', 'return', 'cancel']
+
+
+def oversubscribed():
+    """
+    Types with more pending and active requests than items, counted from the request rows and from the stock
+    counters, as a list of (name, total, pending + active from rows, from counters)
+    """
+    types = HardwareType.objects.filter(name__startswith='%s type ' % PREFIX).with_request_counts()
+    counts = [(hw.name, hw.total_count, hw.counted_reserved + hw.counted_checked_out, hw.not_available_count)
+              for hw in types]
+    return [count for count in counts if max(count[2], count[3]) > count[1]]
+
+
+class Worker(threading.Thread):
+    """Runs operations picked at random from the mix, recording how long each one takes"""
+
+    def __init__(self, number, operations, mix, hacker_ids, types, admin, seed):
+        super(Worker, self).__init__(name='hardware-loadtest-%d' % number)
+        self.operations = operations
+        self.mix = mix
+        self.hacker_ids = hacker_ids
+        self.types = types
+        self.admin = admin
+        self.random = random.Random(seed + number)
+        # Operation to list of durations in milliseconds
+        self.timings = {operation: [] for operation in OPERATIONS}
+        self.denied = 0
+        self.skipped = 0
+        self.errors = []
+
+    def run_operation(self, operation, hacker_id):
+        if operation == 'request':
+            hw = self.random.choice(self.types)
+            _, denied = hw.request_many(self.hackers[hacker_id], self.random.randint(1, 2))
+            self.denied += denied
+            return True
+        if operation in ('pickup', 'cancel'):
+            ids = list(Request.pending_objects(hacker_id).values_list('pk', flat=True)[:2])
+        else:
+            ids = list(Request.active_objects(hacker_id).values_list('pk', flat=True)[:2])
+        if not ids:
+            return False
+        if operation == 'pickup':
+            Request.bulk_pickup(ids, self.admin)
+        elif operation == 'return':
+            Request.bulk_return(ids, self.admin)
+        else:
+            Request.bulk_cancel(ids[:1])
+        return True
+
+    def run(self):
+        try:
+            self.hackers = User.objects.in_bulk(self.hacker_ids)
+            for _ in range(self.operations):
+                operation = self.random.choice(self.mix)
+                start = time.time()
+                try:
+                    done = self.run_operation(operation, self.random.choice(self.hacker_ids))
+                except Exception as e:
+                    self.errors.append('%s: %s' % (operation, e))
+                    continue
+                if done:
+                    self.timings[operation].append((time.time() - start) * 1000)
+                else:
+                    self.skipped += 1
+        finally:
+            connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Replays an opening rush of concurrent hardware requests, pick ups, returns and cancels, then checks ' \
+           'no hardware type was oversubscribed. Writes to the database, use a local one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent workers (default 16)')
+        parser.add_argument('--operations', type=int, default=100, help='Operations per worker (default 100)')
+        parser.add_argument('--hackers', type=int, default=200, help='Hackers requesting (default 200)')
+        parser.add_argument('--types', type=int, default=10, help='Hardware types (default 10)')
+        parser.add_argument('--stock', type=int, default=5, help='Items of each type (default 5)')
+        parser.add_argument('--mix', default='request=60,pickup=20,return=10,cancel=10',
+                            help='Weights of each operation (default request=60,pickup=20,return=10,cancel=10)')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed, the same one replays the same operations')
+        parser.add_argument('--check-every', type=float, default=0.5, dest='check_every',
+                            help='Seconds between checks of the invariant while running (default 0.5)')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded rows afterwards')
+
+    def parse_mix(self, mix):
+        weights = []
+        try:
+            for part in mix.split(','):
+                operation, weight = part.split('=')
+                if operation.strip() not in OPERATIONS:
+                    raise ValueError()
+                weights.extend([operation.strip()] * int(weight))
+        except ValueError:
+            raise CommandError('Mix must be a comma separated list of operation=weight, operations are %s' %
+                               ', '.join(OPERATIONS))
+        if not weights:
+            raise CommandError('Mix must have some weight')
+        return weights
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+        if connection.vendor == 'sqlite':
+            self.stderr.write('SQLite serializes writes and has no row locks, use PostgreSQL or MySQL for a '
+                              'realistic run. Lock timeouts are reported as errors.')
+        clean_event(PREFIX)
+        seed = seed_event(types=options['types'], hackers=options['hackers'], requests_per_hacker=0, prefix=PREFIX,
+                          stock=options['stock'])
+        types = list(HardwareType.objects.filter(pk__in=seed.type_ids))
+
+        violations = []
+        stop = threading.Event()
+
+        def monitor():
+            # Samples the invariant while the workers run, an oversubscription may be undone before the end
+            try:
+                while not stop.wait(options['check_every']):
+                    violations.extend(oversubscribed())
+            finally:
+                connection.close()
+
+        workers = [Worker(i, options['operations'], mix, seed.hacker_ids, types, seed.admin, options['seed'])
+                   for i in range(options['threads'])]
+        checker = threading.Thread(target=monitor, name='hardware-loadtest-monitor')
+        try:
+            start = time.time()
+            checker.start()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.time() - start
+            stop.set()
+            checker.join()
+            violations.extend(oversubscribed())
+            out_of_sync = HardwareType.objects.filter(pk__in=seed.type_ids).with_request_counts().exclude(
+                reserved_count=F('counted_reserved'), checked_out_count=F('counted_checked_out')).count()
+        finally:
+            stop.set()
+            if not options['keep']:
+                clean_event(PREFIX)
+
+        done = sum(len(timings) for worker in workers for timings in worker.timings.values())
+        errors = [error for worker in workers for error in worker.errors]
+        self.stdout.write('%d operations in %.1fs, %.1f per second, %d skipped with nothing to do, %d errors' % (
+            done, elapsed, done / elapsed, sum(worker.skipped for worker in workers), len(errors)))
+        for operation in OPERATIONS:
+            timings = [ms for worker in workers for ms in worker.timings[operation]]
+            if timings:
+                self.stdout.write('  %s: %d, p50 %.1fms, p99 %.1fms, max %.1fms' % (
+                    operation, len(timings), percentile(timings, 50), percentile(timings, 99), max(timings)))
+        self.stdout.write('%d items denied for lack of stock' % sum(worker.denied for worker in workers))
+        for error in errors[:10]:
+            self.stderr.write(error)
+
+        if violations or out_of_sync:
+            for name, total, rows, counters in violations[:10]:
+                self.stderr.write('%s: %d items, %d requested or out by rows, %d by counters' % (
+                    name, total, rows, counters))
+            raise CommandError('%d oversubscription samples, %d types with out of sync counters' % (
+                len(violations), out_of_sync))
+        self.stdout.write(self.style.SUCCESS('No hardware type was oversubscribed'))
@@ -0,0 +1,42 @@
+import io
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hardware.importer import FORMATS, parse, import_types
+
+
+class Command(BaseCommand):
+    help = 'Creates or updates hardware types, matched by name, from a CSV or JSON catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header line, or JSON list of objects, with the name, '
+                                         'description, total_count, url and optionally max_per_user of each type')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Format of the file, guessed from its extension if not given')
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                            help='Only show the changes, without saving them')
+        parser.add_argument('--batch-size', type=int, default=200, dest='batch_size',
+                            help='Types written per query (default 200)')
+
+    def handle(self, *args, **options):
+        format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        try:
+            with io.open(options['path'], encoding='utf-8-sig') as f:
+                rows = parse(f.read(), format)
+        except (IOError, ValueError) as e:
+            raise CommandError(str(e))
+
+        results = import_types(rows, dry_run=options['dry_run'], batch_size=options['batch_size'])
+        for result in results:
+            if result.action != 'unchanged' or options['verbosity'] > 1:
+                self.stdout.write(str(result))
+        errors = sum(1 for result in results if result.action == 'error')
+        if errors:
+            raise CommandError('%d invalid rows, nothing was imported' % errors)
+        summary = '%d created, %d updated, %d unchanged' % tuple(
+            sum(1 for result in results if result.action == action) for action in ('create', 'update', 'unchanged'))
+        if options['dry_run']:
+            self.stdout.write('Dry run, nothing was saved: ' + summary)
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from hardware.models import HardwareType, HardwareItem, Request, WaitlistEntry
+from hardware.signals import notify_requests_changed
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the stock counters of every hardware type from its requests, and the total count of types ' \
+           'tracking items from them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', dest='check',
+                            help='Only verify the counters, exit with an error if any of them is out of sync')
+
+    def handle(self, *args, **options):
+        check = options['check']
+        if not check:
+            expired = Request.expire_overdue()
+            if expired:
+                self.stdout.write('Expired %d overdue requests' % expired)
+
+        fixed_ids = set()
+        with transaction.atomic():
+            # Lock every type so no request changes state while counting
+            list(HardwareType.objects.order_by('pk').select_for_update().values_list('pk', flat=True))
+            items = HardwareItem.counts()
+            for hw in HardwareType.objects.filter(tracks_items=True):
+                if hw.total_count == items.get(hw.pk, 0):
+                    continue
+                fixed_ids.add(hw.pk)
+                self.stdout.write('%s: total %d -> %d tracked items' % (hw.name, hw.total_count, items.get(hw.pk, 0)))
+                if not check:
+                    HardwareType.objects.filter(pk=hw.pk).update(total_count=items.get(hw.pk, 0))
+            for hw in HardwareType.objects.with_request_counts():
+                if hw.reserved_count == hw.counted_reserved and hw.checked_out_count == hw.counted_checked_out:
+                    continue
+                fixed_ids.add(hw.pk)
+                self.stdout.write('%s: reserved %d -> %d, checked out %d -> %d' % (
+                    hw.name, hw.reserved_count, hw.counted_reserved, hw.checked_out_count, hw.counted_checked_out))
+                if not check:
+                    HardwareType.objects.filter(pk=hw.pk).update(reserved_count=hw.counted_reserved,
+                                                                 checked_out_count=hw.counted_checked_out)
+            if fixed_ids and not check:
+                # Updates send no signals, the cached and live availability is refreshed and freed items go to the
+                # waiters
+                notify_requests_changed(HardwareType, fixed_ids, [])
+                WaitlistEntry.promote(fixed_ids)
+
+        if check and fixed_ids:
+            raise CommandError('%d hardware types have out of sync counters' % len(fixed_ids))
+        if check:
+            self.stdout.write(self.style.SUCCESS('All hardware counters are in sync'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Rebuilt counters, %d hardware types fixed' % len(fixed_ids)))
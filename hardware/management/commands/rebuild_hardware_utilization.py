@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from hardware.analytics import rebuild_buckets
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the hardware utilization rollups from the requests, e.g. after editing requests by hand or ' \
+           'changing HARDWARE_UTILIZATION_BUCKET'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, dest='chunk_size',
+                            help='Requests read per query (default 2000)')
+
+    def handle(self, *args, **options):
+        written = rebuild_buckets(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d utilization buckets' % written))
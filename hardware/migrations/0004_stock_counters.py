@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:42
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_counters(apps, schema_editor):
+    HardwareType = apps.get_model('hardware', 'HardwareType')
+    Request = apps.get_model('hardware', 'Request')
+    now = timezone.now()
+    time_expired = now - timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
+    Request.objects.filter(pickup_time__isnull=True, created_at__lt=time_expired).update(expired_at=now)
+    for hw in HardwareType.objects.all():
+        hw.reserved_count = Request.objects.filter(type=hw, pickup_time__isnull=True, expired_at__isnull=True).count()
+        hw.checked_out_count = Request.objects.filter(type=hw, pickup_time__isnull=False,
+                                                      return_time__isnull=True).count()
+        hw.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hardware', '0003_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hardwaretype',
+            name='checked_out_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hardwaretype',
+            name='reserved_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='request',
+            name='expired_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
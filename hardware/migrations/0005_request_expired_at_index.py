@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hardware', '0004_stock_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='request',
+            name='expired_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
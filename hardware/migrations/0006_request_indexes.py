@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 17:43
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+# Only backends supporting partial indexes, the rest use the expired_at index
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def create_overdue_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute('CREATE INDEX hardware_request_overdue ON hardware_request (created_at) '
+                              'WHERE pickup_time IS NULL AND expired_at IS NULL')
+
+
+def drop_overdue_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute('DROP INDEX hardware_request_overdue')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('hardware', '0005_request_expired_at_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='request',
+            index_together=set([('requestor', 'pickup_time', 'expired_at'), ('requestor', 'return_time', 'pickup_time'), ('return_time', 'pickup_time')]),
+        ),
+        # Request.overdue_objects, used by the expiry sweeper
+        migrations.RunPython(create_overdue_index, drop_overdue_index),
+    ]
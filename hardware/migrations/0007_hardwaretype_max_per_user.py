@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hardware', '0006_request_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hardwaretype',
+            name='max_per_user',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
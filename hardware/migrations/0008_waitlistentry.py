@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:03
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('hardware', '0007_hardwaretype_max_per_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='hardware.HardwareType')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hardware_waitlist', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='waitlistentry',
+            unique_together=set([('user', 'type')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='waitlistentry',
+            index_together=set([('type', 'id')]),
+        ),
+    ]
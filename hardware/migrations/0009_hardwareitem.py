@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hardware', '0008_waitlistentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HardwareItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=100, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='hardware.HardwareType')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='request',
+            name='item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='loans', to='hardware.HardwareItem'),
+        ),
+    ]
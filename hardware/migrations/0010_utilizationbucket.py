@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hardware', '0009_hardwareitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UtilizationBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('requested', models.IntegerField(default=0)),
+                ('picked_up', models.IntegerField(default=0)),
+                ('returned', models.IntegerField(default=0)),
+                ('expired', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('loan_seconds', models.BigIntegerField(default=0)),
+                ('peak_checked_out', models.IntegerField(default=0)),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='utilization', to='hardware.HardwareType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='utilizationbucket',
+            unique_together=set([('type', 'start')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='utilizationbucket',
+            index_together=set([('start', 'type')]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_tracks_items(apps, schema_editor):
+    # The total count of types with items was kept equal to their number of items
+    HardwareType = apps.get_model('hardware', 'HardwareType')
+    HardwareType.objects.filter(items__isnull=False).update(tracks_items=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hardware', '0010_utilizationbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hardwaretype',
+            name='tracks_items',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(fill_tracks_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,88 @@
+import base64
+import json
+
+from django.db.models import Q
+
+
+class KeysetPaginationMixin(object):
+    """
+    Paginates a SingleTableMixin view by a cursor over indexed columns instead of an offset, so a page costs the
+    same whatever its depth and no count is needed. keyset lists the fields the rows are ordered by, prefixed
+    with '-' for descending order, and must end with a unique field. Columns can't be sorted in this mode.
+    """
+    keyset = ('-id',)
+    per_page = 50
+
+    def _fields(self):
+        return [(field.lstrip('-'), field.startswith('-')) for field in self.keyset]
+
+    def encode_cursor(self, row):
+        # Dates keep their microseconds, or rows sharing the millisecond would be skipped
+        values = [getattr(row, name) for name, _ in self._fields()]
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor, model):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            fields = self._fields()
+            if len(values) != len(fields):
+                return None
+            return [model._meta.get_field(name).to_python(value) for (name, _), value in zip(fields, values)]
+        except Exception:
+            # A tampered or stale cursor falls back to the first page
+            return None
+
+    def _after(self, values, backwards):
+        """Filter for the rows after the cursor values in the keyset order, or before them if backwards"""
+        condition = None
+        for (name, descending), value in reversed(list(zip(self._fields(), values))):
+            beyond = Q(**{'%s__%s' % (name, 'lt' if descending != backwards else 'gt'): value})
+            condition = beyond if condition is None else beyond | (Q(**{name: value}) & condition)
+        return condition
+
+    def get_table_data(self):
+        queryset = super(KeysetPaginationMixin, self).get_table_data()
+        cursor = self.request.GET.get('after') or self.request.GET.get('before')
+        values = self.decode_cursor(cursor, queryset.model) if cursor else None
+        backwards = values is not None and not self.request.GET.get('after')
+        order = list(self.keyset)
+        if values is not None:
+            queryset = queryset.filter(self._after(values, backwards))
+        if backwards:
+            order = [field[1:] if field.startswith('-') else '-' + field for field in order]
+        # One extra row tells whether there is another page
+        rows = list(queryset.order_by(*order)[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, values is not None
+        self.keyset_next = self.encode_cursor(rows[-1]) if rows and has_next else None
+        self.keyset_previous = self.encode_cursor(rows[0]) if rows and has_previous else None
+        return rows
+
+    def get_table_pagination(self, table):
+        return False
+
+    def get_table_kwargs(self):
+        kwargs = super(KeysetPaginationMixin, self).get_table_kwargs()
+        kwargs['orderable'] = False
+        return kwargs
+
+    def _page_url(self, key, cursor):
+        params = self.request.GET.copy()
+        params.pop('after', None)
+        params.pop('before', None)
+        if cursor:
+            params[key] = cursor
+        return '?' + params.urlencode()
+
+    def get_context_data(self, **kwargs):
+        c = super(KeysetPaginationMixin, self).get_context_data(**kwargs)
+        c['keyset_next_url'] = self._page_url('after', self.keyset_next) if self.keyset_next else None
+        c['keyset_previous_url'] = self._page_url('before', self.keyset_previous) if self.keyset_previous else None
+        c['keyset_first_url'] = self._page_url('after', None) if self.keyset_previous else None
+        return c
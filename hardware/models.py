@@ -1,14 +1,56 @@
-from datetime import timedelta
+from collections import Counter
+from datetime import datetime, timedelta
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Q, F, Count, Case, When, Value, IntegerField, ExpressionWrapper, DateTimeField, \
+    DurationField, OuterRef, Subquery
+from django.db.models.functions import Greatest
 from django.utils import timezone
 
+from hardware.instrumentation import timed
+from hardware.signals import notify_requests_changed, notified_once
 from user.models import User
 
 
+class HardwareTypeQuerySet(models.QuerySet):
+
+    def with_availability(self):
+        """Annotates the available count of each type from the stock counters, so it can be filtered and sorted"""
+        available = F('total_count') - F('reserved_count') - F('checked_out_count')
+        return self.annotate(annotated_available_count=ExpressionWrapper(available, output_field=IntegerField()))
+
+    def available(self):
+        """Types with at least one item available, filtered in the database"""
+        return self.with_availability().filter(annotated_available_count__gt=0)
+
+    def with_request_counts(self):
+        """
+        Annotates the stock counters computed from the request rows in a single aggregated query, used to
+        rebuild and verify the stored ones
+        """
+        exists = Q(requests__id__isnull=False)
+        reserved = Q(requests__pickup_time__isnull=True, requests__expired_at__isnull=True)
+        checked_out = Q(requests__pickup_time__isnull=False, requests__return_time__isnull=True)
+        return self.annotate(
+            counted_reserved=Count(Case(When(exists & reserved, then=1), output_field=IntegerField())),
+            counted_checked_out=Count(Case(When(exists & checked_out, then=1), output_field=IntegerField())),
+        )
+
+    def with_waitlist(self, user_id):
+        """
+        Annotates how many hackers wait for each type and the position of the user in its waitlist, 0 if they
+        are not waiting
+        """
+        entry = WaitlistEntry.objects.filter(type=OuterRef('pk'), user_id=user_id).values('pk')[:1]
+        return self.annotate(
+            waitlist_count=Count('waitlist'),
+            waitlist_position=Count(Case(When(waitlist__pk__lte=Subquery(entry), then=1),
+                                         output_field=IntegerField())),
+        )
+
+
 class HardwareType(models.Model):
     """Represents a kind of hardware"""
 
@@ -23,36 +65,184 @@ class HardwareType(models.Model):
 
     url = models.URLField(null=True, blank=True)
 
+    # Most items of this type a hacker can have requested or out at once, HARDWARE_MAX_PER_TYPE if not set
+    max_per_user = models.PositiveIntegerField(null=True, blank=True)
+
+    # Requests waiting to be picked up, kept up to date on every request state transition
+    reserved_count = models.IntegerField(default=0, editable=False)
+
+    # Items picked up and not returned yet, kept up to date on every request state transition
+    checked_out_count = models.IntegerField(default=0, editable=False)
+
+    # Every unit has an item, so the total count follows the number of items
+    tracks_items = models.BooleanField(default=False, editable=False)
+
+    objects = HardwareTypeQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # Counters are only changed with _update_counters and tracking by the items, a stale instance (e.g. an admin
+        # form) can't overwrite them
+        adding = self._state.adding
+        if not adding and 'update_fields' not in kwargs:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields if not f.primary_key and
+                                       f.name not in ('reserved_count', 'checked_out_count', 'tracks_items')]
+        with transaction.atomic():
+            super(HardwareType, self).save(*args, **kwargs)
+            if not adding:
+                # A raised total count goes to the waiters first
+                WaitlistEntry.restock([self.pk])
+
     @classmethod
     def prefetch_objects(cls):
         return cls.objects.prefetch_related('requests')
 
+    @classmethod
+    def with_availability(cls):
+        return cls.objects.with_availability()
+
+    @classmethod
+    def _update_counters(cls, reserved=None, checked_out=None):
+        """Adds the given deltas by type id to the stock counters in a single UPDATE"""
+        reserved, checked_out = reserved or {}, checked_out or {}
+        type_ids = set(reserved) | set(checked_out)
+        if not type_ids:
+            return
+
+        def delta(deltas):
+            return Case(*[When(pk=pk, then=Value(d)) for pk, d in deltas.items()], default=Value(0),
+                        output_field=IntegerField())
+
+        cls.objects.filter(pk__in=type_ids).update(reserved_count=F('reserved_count') + delta(reserved),
+                                                   checked_out_count=F('checked_out_count') + delta(checked_out))
+
     @property
     def not_available_count(self):
-        time_expired = timezone.now() - timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
-        return self.requests.filter(Q(pickup_time__isnull=False, return_time__isnull=True) |
-                                    Q(created_at__gte=time_expired, pickup_time__isnull=True)).count()
+        return self.reserved_count + self.checked_out_count
 
     @property
     def active_count(self):
-        return self.requests.filter(pickup_time__isnull=False, return_time__isnull=True).count()
+        return self.checked_out_count
 
     @property
     def remaining_count(self):
         return self.total_count - self.active_count
 
     @property
+    @timed('HardwareType.available_count')
     def available_count(self):
         return self.total_count - self.not_available_count
 
-    def request(self, user):
-        if self.available_count == 0:
+    def _lock_available(self):
+        """Locks this type until the transaction ends, returns its up to date available count"""
+        hw = HardwareType.objects.select_for_update().get(pk=self.pk)
+        # Items freed without promoting the waiters (e.g. expired requests not swept yet) go to them first
+        if Request.expire_overdue(type_ids=[self.pk]) or WaitlistEntry.promote([self.pk]):
+            hw = HardwareType.objects.get(pk=self.pk)
+        return hw.available_count
+
+    def _limits(self):
+        """Most items a hacker can have overall and of this type, None if unlimited"""
+        max_outstanding = getattr(settings, 'HARDWARE_MAX_OUTSTANDING', None)
+        max_of_type = self.max_per_user if self.max_per_user is not None else \
+            getattr(settings, 'HARDWARE_MAX_PER_TYPE', None)
+        return max_outstanding, max_of_type
+
+    def _allowance(self, user):
+        """
+        Locks the user until the transaction ends, returns how many more items of this type they can have within
+        their limits: HARDWARE_MAX_OUTSTANDING items overall and max_per_user of this type. None if unlimited.
+        """
+        max_outstanding, max_of_type = self._limits()
+        if max_outstanding is None and max_of_type is None:
             return None
-
-        r = Request(requestor=user, type=self)
-        r.save()
+        # Concurrent requests of the same user for other types wait here, so their counts can't go stale
+        list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+        counts = Request.outstanding_counts(user.pk, self.pk)
+        allowance = [max_outstanding - counts['total'] if max_outstanding is not None else None,
+                     max_of_type - counts['type'] if max_of_type is not None else None]
+        return max(min(a for a in allowance if a is not None), 0)
+
+    def _grant(self, user, amount):
+        """
+        Locks this type and the user until the transaction ends, returns how many of amount items the user can
+        get within the stock and their limits
+        """
+        granted = min(amount, self._lock_available())
+        if granted > 0:
+            allowance = self._allowance(user)
+            if allowance is not None:
+                granted = min(granted, allowance)
+        return max(granted, 0)
+
+    @timed('HardwareType.request')
+    def request(self, user):
+        with transaction.atomic():
+            if not self._grant(user, 1):
+                return None
+            r = Request.objects.create(requestor=user, type=self)
+            HardwareType._update_counters(reserved={self.pk: 1})
+            WaitlistEntry.objects.filter(user=user, type=self).delete()
+            UtilizationBucket.record(requested={self.pk: 1})
         return r
 
+    @timed('HardwareType.request_many')
+    def request_many(self, user, amount):
+        """
+        Requests amount items of this type for user checking availability only once. Returns a tuple with the
+        number of items granted and denied.
+        """
+        amount = max(amount, 0)
+        with transaction.atomic():
+            granted = self._grant(user, amount)
+            if granted:
+                Request.objects.bulk_create([Request(requestor=user, type=self) for _ in range(granted)])
+                HardwareType._update_counters(reserved={self.pk: granted})
+                WaitlistEntry.objects.filter(user=user, type=self).delete()
+                UtilizationBucket.record(requested={self.pk: granted})
+                notify_requests_changed(Request, [self.pk], [user.pk])
+        return granted, amount - granted
+
+
+class HardwareItem(models.Model):
+    """A single tracked unit of a hardware type, identified by the code on its label"""
+    type = models.ForeignKey(HardwareType, related_name='items')
+
+    # Serial number or barcode, scanned at the desk
+    code = models.CharField(max_length=100, unique=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.code
+
+    @classmethod
+    def _sync_total(cls, type_id):
+        """
+        Sets the total count of the type to its number of items once there are as many items as units, so
+        availability is still read from the type alone. Until then the units without an item are still counted.
+        Raises ValidationError if fewer items would be left than requested or out. Items added concurrently wait for
+        the type lock and are counted.
+        """
+        with transaction.atomic():
+            hw = HardwareType.objects.select_for_update().filter(pk=type_id).first()
+            if not hw:
+                return
+            count = cls.objects.filter(type_id=type_id).count()
+            if not hw.tracks_items and count < hw.total_count:
+                return
+            if count < hw.not_available_count:
+                raise ValidationError('%d items of %s are requested or out, can\'t go down to %d' % (
+                    hw.not_available_count, hw.name, count))
+            HardwareType.objects.filter(pk=type_id).update(total_count=count, tracks_items=count > 0)
+            notify_requests_changed(HardwareType, [type_id], [])
+            WaitlistEntry.promote([type_id])
+
+    @classmethod
+    def counts(cls):
+        """Number of items of each type with tracked items, by type id"""
+        return dict(cls.objects.order_by().values('type_id').annotate(count=Count('pk'))
+                    .values_list('type_id', 'count'))
+
 
 class Request(models.Model):
     """
@@ -79,54 +269,437 @@ class Request(models.Model):
     # Organizer who received back out item
     returned_to = models.ForeignKey(User, related_name='hardware_admin_return', null=True, blank=True)
 
+    # If not null: request was not picked up in time and its reservation has been released
+    expired_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    # Unit handed out, if its type tracks items. Loans are kept when a unit is removed
+    item = models.ForeignKey(HardwareItem, null=True, blank=True, related_name='loans', on_delete=models.PROTECT)
+
+    class Meta:
+        index_together = [
+            # pending_objects and historic_objects
+            ('requestor', 'pickup_time', 'expired_at'),
+            # active_objects
+            ('requestor', 'return_time', 'pickup_time'),
+            # active_overall, sorted by pickup time
+            ('return_time', 'pickup_time'),
+        ]
+
     @classmethod
     def pending_objects(cls, user_id):
-        time_expired = timezone.now() - timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
-        return cls.objects.filter(requestor_id=user_id, created_at__gte=time_expired, pickup_time__isnull=True)
+        return cls.objects.filter(requestor_id=user_id, pickup_time__isnull=True, expired_at__isnull=True)
 
     @classmethod
     def historic_objects(cls, user_id):
-        time_expired = timezone.now() - timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
-        return cls.objects.filter(Q(requestor_id=user_id, created_at__gte=time_expired, pickup_time__isnull=True)
+        return cls.objects.filter(Q(requestor_id=user_id, pickup_time__isnull=True, expired_at__isnull=True)
                                   | Q(requestor_id=user_id, pickup_time__isnull=False))
 
     @classmethod
     def active_objects(cls, user_id):
         return cls.objects.filter(requestor_id=user_id, pickup_time__isnull=False, return_time__isnull=True)
 
+    @classmethod
+    def open_objects(cls, user_id):
+        """Pending and active requests of the user together"""
+        return cls.objects.filter(Q(requestor_id=user_id, pickup_time__isnull=True, expired_at__isnull=True)
+                                  | Q(requestor_id=user_id, pickup_time__isnull=False, return_time__isnull=True))
+
+    @classmethod
+    def outstanding_counts(cls, user_id, type_id):
+        """Counts the pending and active requests of the user, overall and of the type, in a single query"""
+        return cls.open_objects(user_id).aggregate(
+            total=Count('pk'),
+            type=Count(Case(When(type_id=type_id, then=1), output_field=IntegerField())),
+        )
+
+    @classmethod
+    def outstanding_by_type(cls, user_ids):
+        """Counts the pending and active requests of each of the users by (user id, type id), in a single query"""
+        rows = cls.objects.filter(Q(pickup_time__isnull=True, expired_at__isnull=True)
+                                  | Q(pickup_time__isnull=False, return_time__isnull=True),
+                                  requestor_id__in=user_ids).order_by() \
+            .values('requestor_id', 'type_id').annotate(count=Count('pk'))
+        return {(row['requestor_id'], row['type_id']): row['count'] for row in rows}
+
     @classmethod
     def active_overall(cls):
         return cls.objects.filter(pickup_time__isnull=False, return_time__isnull=True)
 
+    @classmethod
+    def count_by_state(cls, user_id):
+        """Counts the pending and active requests of the user in a single query"""
+        pending = Q(pickup_time__isnull=True, expired_at__isnull=True)
+        active = Q(pickup_time__isnull=False, return_time__isnull=True)
+        return cls.objects.filter(requestor_id=user_id).aggregate(
+            pending=Count(Case(When(pending, then=1), output_field=IntegerField())),
+            active=Count(Case(When(active, then=1), output_field=IntegerField())),
+        )
+
+    @classmethod
+    def overdue_objects(cls, now=None):
+        time_expired = (now or timezone.now()) - timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
+        return cls.objects.filter(pickup_time__isnull=True, expired_at__isnull=True, created_at__lt=time_expired)
+
+    @classmethod
+    def open_loan(cls, code):
+        """The request the unit with the scanned code is out on, in a single indexed query. None if it is in."""
+        return cls.objects.filter(item__code=code, pickup_time__isnull=False, return_time__isnull=True) \
+            .select_related('type', 'requestor').first()
+
+    @classmethod
+    def with_remaining_time(cls, queryset=None):
+        """
+        Annotates remaining_time as annotated_remaining_time, computed by the database so it can be sorted on.
+        It is negative for requests overdue but not expired yet.
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        time_expired = timezone.now() - timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
+        remaining = ExpressionWrapper(F('created_at') - Value(time_expired, output_field=DateTimeField()),
+                                      output_field=DurationField())
+        return queryset.annotate(annotated_remaining_time=Case(
+            When(pickup_time__isnull=True, expired_at__isnull=True, then=remaining),
+            default=Value(timedelta(0), output_field=DurationField()), output_field=DurationField()))
+
+    @property
+    def expires_at(self):
+        return self.created_at + timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
+
     @property
     def remaining_time(self):
         if self.pickup_time:
             return timedelta(seconds=0)
-        return (self.created_at + timedelta(minutes=settings.HARDWARE_REQUEST_TIME)) - timezone.now()
+        return self.expires_at - timezone.now()
 
-    def pickup(self, organizer):
-        if self.pickup_time:
-            raise ValidationError('Request has been picked up already!')
-        if self.remaining_time < timedelta(seconds=0):
-            raise ValidationError('Request has expired!')
-        if self.type.remaining_count <= 0:
-            raise ValidationError('No items available')
+    @classmethod
+    def _lock_types(cls, ids):
+        """
+        Locks the hardware types of the requests with the given ids until the transaction ends. Every change
+        on the stock counters of a type happens while holding this lock. Returns the locked types by id.
+        """
+        type_ids = set(cls.objects.filter(pk__in=ids).values_list('type_id', flat=True))
+        # Always in the same order, so batches sharing types wait for each other instead of deadlocking
+        return {hw.pk: hw for hw in HardwareType.objects.filter(pk__in=type_ids).order_by('pk').select_for_update()}
 
-        self.borrowed_by = organizer
-        self.pickup_time = timezone.now()
-        self.save()
+    @classmethod
+    def expire_overdue(cls, type_ids=None, batch_size=500):
+        """
+        Marks the requests that were not picked up in time as expired, releasing their reservations. Works in
+        batches of batch_size requests, each one in its own transaction. Returns the number of requests expired.
+        """
+        now = timezone.now()
+        overdue = cls.overdue_objects(now)
+        if type_ids is not None:
+            overdue = overdue.filter(type_id__in=type_ids)
+
+        total = 0
+        while True:
+            ids = list(overdue.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                cls._lock_types(ids)
+                batch = overdue.filter(pk__in=ids)
+                rows = list(batch.values_list('type_id', 'requestor_id'))
+                batch.update(expired_at=now)
+                expired = Counter(type_id for type_id, _ in rows)
+                HardwareType._update_counters(reserved={type_id: -count for type_id, count in expired.items()})
+                UtilizationBucket.record(now, expired=expired)
+                notify_requests_changed(cls, expired, [user_id for _, user_id in rows])
+                WaitlistEntry.promote(expired)
+            total += len(rows)
+            if len(ids) < batch_size:
+                break
+        return total
+
+    @classmethod
+    @timed('Request.bulk_pickup')
+    def bulk_pickup(cls, ids, organizer, codes=None):
+        """
+        Picks up all the requests in ids at once, checking stock per type. codes maps request ids to the code of
+        the unit handed out, required for types that track every unit. Returns the errors found as a dict of
+        hardware type name to message, requests with errors are left untouched.
+        """
+        codes = {int(pk): code for pk, code in (codes or {}).items() if code}
+        errors = {}
+        with transaction.atomic():
+            locked = cls._lock_types(ids)
+            remaining = {pk: hw.remaining_count for pk, hw in locked.items()}
+            # Units of the locked types can't be handed out concurrently, their loans are counted safely
+            out = Q(loans__pickup_time__isnull=False, loans__return_time__isnull=True)
+            items = {item.code: item for item in HardwareItem.objects.filter(code__in=codes.values()).annotate(
+                out_count=Count(Case(When(out, then=1), output_field=IntegerField())))} if codes else {}
+            now = timezone.now()
+            time_expired = now - timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
+            picked, handed = [], {}
+            for r in cls.objects.filter(pk__in=ids).select_related('type'):
+                item = items.get(codes.get(r.pk))
+                if r.pickup_time:
+                    errors[r.type.name] = 'Request has been picked up already!'
+                elif r.expired_at or r.created_at < time_expired:
+                    errors[r.type.name] = 'Request has expired!'
+                elif remaining[r.type_id] <= 0:
+                    errors[r.type.name] = 'No items available'
+                elif locked[r.type_id].tracks_items and r.pk not in codes:
+                    errors[r.type.name] = 'Scan the item code'
+                elif r.pk in codes and not item:
+                    errors[r.type.name] = 'Unknown item %s' % codes[r.pk]
+                elif item and item.type_id != r.type_id:
+                    errors[r.type.name] = 'Item %s is of another type' % item.code
+                elif item and (item.out_count or item.pk in handed.values()):
+                    errors[r.type.name] = 'Item %s is already out' % item.code
+                else:
+                    remaining[r.type_id] -= 1
+                    picked.append(r)
+                    if item:
+                        handed[r.pk] = item.pk
+            if picked:
+                update = {'borrowed_by': organizer, 'pickup_time': now}
+                if handed:
+                    update['item'] = Case(*[When(pk=pk, then=Value(item_id)) for pk, item_id in handed.items()],
+                                          default=None, output_field=IntegerField())
+                cls.objects.filter(pk__in=[r.pk for r in picked]).update(**update)
+                counts = Counter(r.type_id for r in picked)
+                HardwareType._update_counters(reserved={type_id: -count for type_id, count in counts.items()},
+                                              checked_out=counts)
+                UtilizationBucket.record(now, picked_up=counts, checked_out={
+                    type_id: locked[type_id].checked_out_count + count for type_id, count in counts.items()})
+                notify_requests_changed(cls, counts, [r.requestor_id for r in picked])
+        return errors
+
+    @classmethod
+    @timed('Request.bulk_return')
+    def bulk_return(cls, ids, organizer):
+        """
+        Returns all the requests in ids at once. Returns the errors found as a dict of hardware type name
+        to message, requests with errors are left untouched.
+        """
+        errors = {}
+        with transaction.atomic():
+            locked = cls._lock_types(ids)
+            returned = []
+            for r in cls.objects.filter(pk__in=ids).select_related('type'):
+                if not r.pickup_time:
+                    errors[r.type.name] = 'Request has not been picked up yet'
+                elif r.return_time:
+                    errors[r.type.name] = 'Request has been returned already!'
+                else:
+                    returned.append(r)
+            if returned:
+                now = timezone.now()
+                cls.objects.filter(pk__in=[r.pk for r in returned]).update(returned_to=organizer, return_time=now)
+                counts = Counter(r.type_id for r in returned)
+                HardwareType._update_counters(checked_out={type_id: -count for type_id, count in counts.items()})
+                loan_seconds = Counter()
+                for r in returned:
+                    loan_seconds[r.type_id] += int((now - r.pickup_time).total_seconds())
+                UtilizationBucket.record(now, returned=counts, loan_seconds=loan_seconds, checked_out={
+                    type_id: locked[type_id].checked_out_count for type_id in counts})
+                notify_requests_changed(cls, counts, [r.requestor_id for r in returned])
+                WaitlistEntry.promote(counts)
+        return errors
+
+    @timed('Request.pickup')
+    def pickup(self, organizer):
+        errors = Request.bulk_pickup([self.pk], organizer)
+        if errors:
+            raise ValidationError(list(errors.values()))
+        self.refresh_from_db()
 
+    @timed('Request.return_')
     def return_(self, organizer):
-        if not self.pickup_time and self.remaining_time > 0:
-            raise ValidationError('Request has not been picked up yet')
+        errors = Request.bulk_return([self.pk], organizer)
+        if errors:
+            raise ValidationError(list(errors.values()))
+        self.refresh_from_db()
 
-        self.returned_to = organizer
-        self.return_time = timezone.now()
-        self.save()
+    @classmethod
+    def bulk_cancel(cls, ids):
+        """
+        Cancels all the pending requests in ids at once, deleting them. Returns the errors found as a dict of
+        hardware type name to message, requests with errors are left untouched.
+        """
+        errors = {}
+        with transaction.atomic():
+            cls._lock_types(ids)
+            time_expired = timezone.now() - timedelta(minutes=settings.HARDWARE_REQUEST_TIME)
+            cancelled = []
+            for r in cls.objects.filter(pk__in=ids).select_related('type'):
+                if r.pickup_time:
+                    errors[r.type.name] = 'Item has been picked up'
+                elif r.expired_at or r.created_at < time_expired:
+                    errors[r.type.name] = 'Item has expired'
+                else:
+                    cancelled.append(r)
+            if cancelled:
+                # Changes are notified once below instead of on every post_delete
+                with notified_once():
+                    cls.objects.filter(pk__in=[r.pk for r in cancelled]).delete()
+                counts = Counter(r.type_id for r in cancelled)
+                HardwareType._update_counters(reserved={type_id: -count for type_id, count in counts.items()})
+                UtilizationBucket.record(cancelled=counts)
+                notify_requests_changed(cls, counts, [r.requestor_id for r in cancelled])
+                WaitlistEntry.promote(counts)
+        return errors
 
     def cancel(self):
-        if self.remaining_time < 0:
-            raise ValidationError('Item has expired')
-        if self.pickup_time:
-            raise ValidationError('Item has been picked up')
-        self.delete()
+        errors = Request.bulk_cancel([self.pk])
+        if errors:
+            raise ValidationError(list(errors.values()))
+
+
+class WaitlistEntry(models.Model):
+    """A hacker waiting for an item of a type out of stock, served in order of arrival"""
+    user = models.ForeignKey(User, related_name='hardware_waitlist')
+    type = models.ForeignKey(HardwareType, related_name='waitlist')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('user', 'type')]
+        # Next waiters of a type
+        index_together = [('type', 'id')]
+
+    @classmethod
+    def join(cls, user, hw):
+        """Adds the user to the waitlist of the type, returns an error message if they can't join it"""
+        with transaction.atomic():
+            # Holding the type lock, no item can be freed between checking the stock and joining
+            if hw._lock_available() > 0:
+                return 'There are items available, request them instead'
+            if hw._allowance(user) == 0:
+                return 'You have reached your hardware limit'
+            _, created = cls.objects.get_or_create(user=user, type=hw)
+            if not created:
+                return 'You are already waiting for it'
+        return None
+
+    @classmethod
+    def position(cls, user_id, type_id):
+        """Waiters of the type ahead of the user plus one, None if they are not waiting"""
+        entry = cls.objects.filter(user_id=user_id, type_id=type_id).first()
+        return cls.objects.filter(type_id=type_id, pk__lte=entry.pk).count() if entry else None
+
+    @classmethod
+    def promote(cls, type_ids):
+        """
+        Turns the first waiters of each type into requests, as many as items it has available. Waiters that have
+        reached their limits keep their place and are skipped. Must run in the transaction that freed the items,
+        holding the lock of the types. Queries are the same however many types and waiters there are.
+        """
+        types = {hw.pk: hw for hw in HardwareType.objects.filter(pk__in=type_ids).available()}
+        if not types:
+            return 0
+        available = {pk: hw.annotated_available_count for pk, hw in types.items()}
+        limits = {pk: hw._limits() for pk, hw in types.items()}
+        waiters = list(cls.objects.filter(type_id__in=types).order_by('pk').values_list('pk', 'user_id', 'type_id'))
+
+        # Open items of each waiter overall and by (user id, type id), counting the ones handed out here
+        overall, of_type = Counter(), Counter()
+        if waiters and any(limit != (None, None) for limit in limits.values()):
+            user_ids = sorted(set(user_id for _, user_id, _ in waiters))
+            # Locked at once and in id order, so promotions of different types wait for each other instead of
+            # deadlocking, and concurrent requests of the waiters can't make their counts stale
+            list(User.objects.filter(pk__in=user_ids).order_by('pk').select_for_update().values_list('pk', flat=True))
+            of_type.update(Request.outstanding_by_type(user_ids))
+            for (user_id, _), count in of_type.items():
+                overall[user_id] += count
+
+        promoted = []
+        for pk, user_id, type_id in waiters:
+            max_outstanding, max_of_type = limits[type_id]
+            if available[type_id] <= 0 or max_outstanding is not None and overall[user_id] >= max_outstanding or \
+                    max_of_type is not None and of_type[(user_id, type_id)] >= max_of_type:
+                continue
+            promoted.append((pk, user_id, type_id))
+            available[type_id] -= 1
+            overall[user_id] += 1
+            of_type[(user_id, type_id)] += 1
+        if not promoted:
+            return 0
+        Request.objects.bulk_create([Request(requestor_id=user_id, type_id=type_id)
+                                     for _, user_id, type_id in promoted])
+        cls.objects.filter(pk__in=[pk for pk, _, _ in promoted]).delete()
+        counts = Counter(type_id for _, _, type_id in promoted)
+        HardwareType._update_counters(reserved=counts)
+        UtilizationBucket.record(requested=counts)
+        notify_requests_changed(Request, counts, [user_id for _, user_id, _ in promoted])
+        return len(promoted)
+
+    @classmethod
+    def restock(cls, type_ids):
+        """Promotes the waiters of types whose total count was raised, locking the types itself"""
+        with transaction.atomic():
+            list(HardwareType.objects.filter(pk__in=type_ids).order_by('pk').select_for_update()
+                 .values_list('pk', flat=True))
+            return cls.promote(type_ids)
+
+
+class UtilizationBucket(models.Model):
+    """
+    Activity of a hardware type during a time bucket of HARDWARE_UTILIZATION_BUCKET minutes, kept up to date
+    by every request state transition so analytics never scan the requests
+    """
+    type = models.ForeignKey(HardwareType, related_name='utilization')
+    # Beginning of the bucket
+    start = models.DateTimeField()
+
+    requested = models.IntegerField(default=0)
+    picked_up = models.IntegerField(default=0)
+    returned = models.IntegerField(default=0)
+    # Requests not picked up in time
+    expired = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    # Total time out of the items returned, in seconds
+    loan_seconds = models.BigIntegerField(default=0)
+    # Most items of the type out at once during the bucket
+    peak_checked_out = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('type', 'start')]
+        index_together = [('start', 'type')]
+
+    COUNTERS = ['requested', 'picked_up', 'returned', 'expired', 'cancelled', 'loan_seconds']
+
+    @classmethod
+    def bucket_size(cls):
+        return timedelta(minutes=getattr(settings, 'HARDWARE_UTILIZATION_BUCKET', 15))
+
+    @classmethod
+    def bucket_start(cls, when):
+        """Beginning of the bucket when falls in, buckets are aligned to the epoch"""
+        epoch = timezone.make_aware(datetime(1970, 1, 1), timezone.utc) if timezone.is_aware(when) \
+            else datetime(1970, 1, 1)
+        elapsed = when - epoch
+        size = int(cls.bucket_size().total_seconds())
+        return when - timedelta(seconds=(elapsed.days * 86400 + elapsed.seconds) % size,
+                                microseconds=when.microsecond)
+
+    @classmethod
+    def record(cls, when=None, checked_out=None, **counters):
+        """
+        Adds the deltas by type id of each of the COUNTERS given to the buckets of when, and raises their peak to
+        the items out by type id in checked_out. Must run holding the lock of the types, so the buckets missing
+        can be created safely. A single UPDATE unless a bucket starts.
+        """
+        start = cls.bucket_start(when or timezone.now())
+        checked_out = checked_out or {}
+        type_ids = set(checked_out).union(*counters.values())
+        if not type_ids:
+            return
+
+        def value(field, values, default):
+            return Case(*[When(type_id=pk, then=Value(v)) for pk, v in values.items()], default=default,
+                        output_field=cls._meta.get_field(field))
+
+        update = {field: F(field) + value(field, values, Value(0)) for field, values in counters.items() if values}
+        if checked_out:
+            update['peak_checked_out'] = Greatest('peak_checked_out', value(
+                'peak_checked_out', checked_out, F('peak_checked_out')), output_field=IntegerField())
+        if cls.objects.filter(start=start, type_id__in=type_ids).update(**update) == len(type_ids):
+            return
+        existing = set(cls.objects.filter(start=start, type_id__in=type_ids).values_list('type_id', flat=True))
+        # A new bucket starts with the items already out
+        out = dict(HardwareType.objects.filter(pk__in=type_ids - existing).values_list('pk', 'checked_out_count'))
+        cls.objects.bulk_create([
+            cls(type_id=pk, start=start, peak_checked_out=max(out[pk], checked_out.get(pk, 0)),
+                **{field: values.get(pk, 0) for field, values in counters.items()})
+            for pk in out])
@@ -0,0 +1,49 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+# Sent once the transaction commits whenever requests are created or change state, with the ids of the hardware
+# types and users affected
+requests_changed = Signal(providing_args=['type_ids', 'user_ids'])
+
+
+def notify_requests_changed(sender, type_ids, user_ids):
+    type_ids, user_ids = set(type_ids), set(user_ids)
+    transaction.on_commit(lambda: requests_changed.send(sender=sender, type_ids=type_ids, user_ids=user_ids))
+
+
+_local = threading.local()
+
+
+@contextmanager
+def notified_once():
+    """Silences the receivers of single requests below, for bulk operations that notify their changes once"""
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+
+
+# Bulk operations in the models notify by themselves, these catch single saves and deletes (e.g. from the admin)
+@receiver(post_save, sender='hardware.Request')
+@receiver(post_delete, sender='hardware.Request')
+def request_saved(sender, instance, **kwargs):
+    if getattr(_local, 'depth', 0):
+        return
+    notify_requests_changed(sender, [instance.type_id], [instance.requestor_id])
+
+
+# The total count of types tracking every unit follows their number of items
+@receiver(post_save, sender='hardware.HardwareItem')
+def item_saved(sender, instance, created, **kwargs):
+    if created:
+        sender._sync_total(instance.type_id)
+
+
+@receiver(post_delete, sender='hardware.HardwareItem')
+def item_deleted(sender, instance, **kwargs):
+    sender._sync_total(instance.type_id)
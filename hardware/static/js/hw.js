@@ -65,6 +65,63 @@ let hw = (()=>{
         }
     }
 
+    //Subscribes to the hardware events stream. Keeps every element
+    //with data-hw-available updated with the availability of its
+    //type and triggers 'hw:reservations' on the document with the
+    //current reservations of the hacker
+    obj.initStream = (url)=>{
+        if(!window.EventSource) return
+        let source = new EventSource(url)
+        let updateAvailability = (ev)=>{
+            for(let item of JSON.parse(ev.data))
+                $("[data-hw-available="+item.id+"]").text(item.available)
+        }
+        source.addEventListener('inventory', updateAvailability)
+        source.addEventListener('availability', updateAvailability)
+        source.addEventListener('reservations', (ev)=>{
+            $(document).trigger('hw:reservations', [JSON.parse(ev.data)])
+        })
+        return source
+    }
+
+    obj.timeRemaining = (seconds)=>{
+        if(seconds < 0) seconds = 0
+        let minutes = Math.floor(seconds / 60)
+        seconds %= 60
+        return minutes + (minutes == 1 ? " minute " : " minutes ")
+            + seconds + (seconds == 1 ? " second" : " seconds")
+    }
+
+    //Updates every .hw-countdown element from a single timer. Each one
+    //counts down the seconds in its data-remaining, measured from page
+    //load so the desk clock doesn't matter. Rows that expire are flagged
+    //and 'hw:expired' is triggered on the document
+    obj.initCountdowns = ()=>{
+        let loaded = Date.now()
+        let countdowns = $(".hw-countdown").toArray().map((elem)=>{
+            return {elem: elem, deadline: loaded + parseInt(elem.dataset.remaining, 10) * 1000}
+        })
+        if(!countdowns.length) return
+        let tick = ()=>{
+            let now = Date.now()
+            countdowns = countdowns.filter((countdown)=>{
+                let seconds = Math.round((countdown.deadline - now) / 1000)
+                if(seconds > 0){
+                    countdown.elem.textContent = obj.timeRemaining(seconds)
+                    return true
+                }
+                countdown.elem.textContent = "Expired, refresh the page"
+                $(countdown.elem).closest("tr").addClass("hw-expired warning")
+                $(document).trigger('hw:expired', [countdown.elem])
+                return false
+            })
+            if(!countdowns.length) clearInterval(timer)
+        }
+        let timer = setInterval(tick, 1000)
+        tick()
+        return timer
+    }
+
     //davidwalsh.name
     obj.debounce = function(func, wait, immediate){
         let timeout;
@@ -7,31 +7,29 @@ let hw_admin = ((hw)=>{
     let obj = {}
     let cams = []
 
+    //Inputs with data-hw-lookup suggest hackers from that url
     obj.initTypeaheads = ()=>{
-        if($("#id-email"))
-            $("#id-email").typeahead({
+        $("[data-hw-lookup]").each((i, input)=>{
+            $(input).typeahead({
                 hint:true,
                 highlight:true,
                 minLength:1
             },{
                 displayKey:'email',
+                limit:10,
                 async:true,
                 source: hw.debounce((query, a,b)=>{
-                    hw.ajax_req({
-                        identify_hacker:true,
-                        query:query
-                    }, (data)=>{
-                        let pd = JSON.parse(data)
-                        let filtered = pd.map(x => x.fields)
-                        b(filtered)
+                    $.getJSON(input.dataset.hwLookup, {q: query}, (data)=>{
+                        b(data.results)
                     })
-                }, 500),
+                }, 150),
                 templates:{
                     suggestion:function(data){
                         return "<div>"+ data.name + " ("+data.email+")</div>"
                     }
                 }
             });
+        })
     }
 
     obj.initScanner = ()=>{
@@ -120,10 +118,10 @@ let hw_admin = ((hw)=>{
     }
 
     //Opens a popup with a camera preview. If a QR is detected,
-    //it's value is set into 'inputElem'. 
+    //it's value is set into 'inputElem' and passed to 'cb'. 
     //Clicking the bg cancels the operation
     //pre: call initScanner
-    obj.qrScan = (inputElem)=>{
+    obj.qrScan = (inputElem, cb)=>{
         if(!cams) console.error("I can't scan without a camera")
         if(!localStorage.getItem("selectedCam"))
             localStorage.setItem("selectedCam", 0)
@@ -139,6 +137,7 @@ let hw_admin = ((hw)=>{
         scanner.addListener('scan', function (content) {
             console.info("Read QR content: "+content)
             inputElem.value = content
+            if(cb) cb(content)
             scanner.stop()
             popup.parentNode.removeChild(popup)
             veil.parentNode.removeChild(veil)
@@ -184,6 +183,54 @@ let hw_admin = ((hw)=>{
         
     }
     
+    /* private */
+    //Checkbox list of requests, posting the selected ones to url
+    function renderRequests(items, action, url, done){
+        let list = $("<div class='hw-scan-list'>")
+        list.append($("<h4>").text(action))
+        if(!items.length)
+            return list.append($("<p>").text("Nothing to "+action.toLowerCase()))
+        for(let item of items){
+            list.append($("<label class='checkbox'>").append(
+                $("<input type='checkbox' checked>").val(item.id), " ", $("<span>").text(item.name)))
+        }
+        list.append($("<button type='button' class='btn btn-success btn-block'>").text(action).on("click", ()=>{
+            let selected = list.find("input:checked").map((i, elem)=>elem.value).get()
+            $.ajax({
+                method: 'POST',
+                url: url,
+                traditional: true,
+                data: {selected: selected, csrfmiddlewaretoken: window.CSRF_TOKEN},
+                complete: done
+            })
+        }))
+        return list
+    }
+
+    //Shows the hacker with 'code' and their pending and active
+    //requests in 'panel', all from a single request
+    obj.resolveScan = (panel, code)=>{
+        $.getJSON(panel.data('hwScan'), {code: code}, (data)=>{
+            let refresh = ()=>obj.resolveScan(panel, code)
+            panel.empty()
+            panel.append($("<h3>").text(data.user.name+" ("+data.user.email+")"))
+            panel.append(renderRequests(data.pending, 'Pick up', data.urls.pickup, refresh))
+            panel.append(renderRequests(data.active, 'Return', data.urls.return, refresh))
+            panel.append($("<a>").attr('href', data.urls.history).text('History'))
+        }).fail(()=>{
+            hw.toast("Hacker not found")
+        })
+    }
+
+    obj.initScanDesk = ()=>{
+        let panel = $("#hw-scan-result")
+        if(!panel.length) return
+        let input = document.createElement('input')
+        $("#hw-scan-btn").on("click", ()=>{
+            obj.qrScan(input, (code)=>obj.resolveScan(panel, code))
+        })
+    }
+
     return obj
 })(hw)
 
@@ -191,4 +238,5 @@ document.addEventListener("DOMContentLoaded", ()=>{
     hw_admin.initListeners()
     hw_admin.initTypeaheads()
     hw_admin.initScanner()
+    hw_admin.initScanDesk()
 })
\ No newline at end of file
@@ -0,0 +1,42 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_thread = None
+
+
+def run(interval, batch_size=500, stop_event=None):
+    """Expires overdue hardware requests every interval seconds until stop_event is set"""
+    from hardware.models import Request
+    stop_event = stop_event or threading.Event()
+    while not stop_event.wait(interval):
+        try:
+            Request.expire_overdue(batch_size=batch_size)
+        except Exception:
+            logger.exception('Hardware requests expiry sweep failed')
+        finally:
+            close_old_connections()
+
+
+def start(**kwargs):
+    """
+    Starts the expiry sweeper in a daemon thread, once per process. Runs every HARDWARE_EXPIRY_SWEEP_INTERVAL
+    seconds, set it to None to disable it (e.g. when running expire_hardware_requests from cron instead).
+    """
+    global _thread
+    request_started.disconnect(dispatch_uid='hardware_expiry_sweeper')
+    interval = getattr(settings, 'HARDWARE_EXPIRY_SWEEP_INTERVAL', 30)
+    if not interval:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=run, args=(interval,), name='hardware-expiry-sweeper')
+        _thread.daemon = True
+        _thread.start()
@@ -1,13 +1,16 @@
 import django_filters
 import django_tables2 as tables
+from django import forms
 from django.db.models import Q
+from django.urls import reverse_lazy
 
 from hardware.models import Request, HardwareType
 from user.models import User
 
 
 class RequestorFilter(django_filters.FilterSet):
-    search = django_filters.CharFilter(method='search_filter', label='Search')
+    search = django_filters.CharFilter(method='search_filter', label='Search', widget=forms.TextInput(
+        attrs={'class': 'typeahead', 'autocomplete': 'off', 'data-hw-lookup': reverse_lazy('hw_lookup')}))
 
     def search_filter(self, queryset, name, value):
         return queryset.filter(Q(email__icontains=value) | Q(name__icontains=value))
@@ -63,12 +66,15 @@ class PickupTable(tables.Table):
     countdown = tables.TemplateColumn(
         template_name='include/countdown_column.html',
         verbose_name='Remaining time to pick up', orderable=False)
+    code = tables.TemplateColumn(
+        "<input type='text' name='code_{{record.pk}}' placeholder='Scan if tracked' autocomplete='off'/>",
+        verbose_name='Item', orderable=False)
 
     class Meta:
         model = Request
         attrs = {'class': 'table table-hover'}
         template = 'django_tables2/bootstrap-responsive.html'
-        fields = ['selected', 'type.name', 'countdown']
+        fields = ['selected', 'type.name', 'countdown', 'code']
         empty_text = 'No items have been requested. Ask hacker to fill request before!'
 
 
@@ -79,7 +85,7 @@ class ReturnTable(tables.Table):
         model = Request
         attrs = {'class': 'table table-hover'}
         template = 'django_tables2/bootstrap-responsive.html'
-        fields = ['selected', 'type.name', 'pickup_time']
+        fields = ['selected', 'type.name', 'item.code', 'pickup_time']
         empty_text = 'Hacker has returned all items!'
 
 
@@ -88,7 +94,7 @@ class RequestsTable(tables.Table):
         model = Request
         attrs = {'class': 'table table-hover'}
         template = 'django_tables2/bootstrap-responsive.html'
-        fields = ['type.name', 'pickup_time', 'borrowed_by.email', 'return_time', 'returned_to.email']
+        fields = ['type.name', 'item.code', 'pickup_time', 'borrowed_by.email', 'return_time', 'returned_to.email']
         empty_text = 'No hardware request for current user'
 
 
@@ -117,7 +123,7 @@ class HackerActive(tables.Table):
 class AvailableHardwareTable(tables.Table):
     available = tables.TemplateColumn(
         "{{record.remaining_count}}/{{record.total_count}}",
-        verbose_name='Remaining/Total', accessor="available_count", orderable=True)
+        verbose_name='Remaining/Total', accessor="available_count", order_by=('annotated_available_count',))
 
     class Meta:
         model = HardwareType
@@ -139,8 +145,8 @@ class ActiveHardwareTable(tables.Table):
 class HackerAvailableHardwareTableSelect(tables.Table):
     selected = tables.CheckBoxColumn(accessor="pk", verbose_name='Select')
     available = tables.TemplateColumn(
-        "{{record.available_count}}/{{record.total_count}}",
-        verbose_name='Available/Total', accessor="available_count", orderable=True)
+        "<span data-hw-available='{{record.pk}}'>{{record.available_count}}</span>/{{record.total_count}}",
+        verbose_name='Available/Total', accessor="available_count", order_by=('annotated_available_count',))
 
     class Meta:
         model = HardwareType
@@ -153,7 +159,7 @@ class HackerAvailableHardwareTableSelect(tables.Table):
 class HackerAvailableHardwareTable(tables.Table):
     details = tables.TemplateColumn(
         "{% if record.url %}<a href=\"{{record.url}}\" target=\"_blank\">Details</a>{%endif%}",
-        verbose_name='Details', accessor="available_count", orderable=True)
+        verbose_name='Details', accessor="available_count", order_by=('annotated_available_count',))
 
 
     class Meta:
@@ -165,6 +171,9 @@ class HackerAvailableHardwareTable(tables.Table):
 
 
 class SelectCountHardwareTable(tables.Table):
+    available_count = tables.TemplateColumn(
+        "<span data-hw-available='{{record.pk}}'>{{record.available_count}}</span>",
+        verbose_name='Available count', order_by=('annotated_available_count',))
     amount = tables.TemplateColumn(
         "<input type='number' min='0' max='{{record.available_count}}' name='amount_{{record.pk}}' value='1'/> ",
         verbose_name='Desired amount', orderable=False)
@@ -175,3 +184,49 @@ class SelectCountHardwareTable(tables.Table):
         template = 'django_tables2/bootstrap-responsive.html'
         fields = ['name', 'description', 'available_count', ]
         empty_text = 'Items not available or no items selected. Go back to see current available items!'
+
+
+class WaitlistTable(tables.Table):
+    available = tables.TemplateColumn(
+        "<span data-hw-available='{{record.pk}}'>{{record.available_count}}</span>/{{record.total_count}}",
+        verbose_name='Available/Total', orderable=False)
+    waitlist_count = tables.Column(verbose_name='Waiting', orderable=False)
+    position = tables.TemplateColumn(
+        "{% if record.waitlist_position %}{{record.waitlist_position}}{% else %}-{% endif %}",
+        verbose_name='Your position', orderable=False)
+    action = tables.TemplateColumn(
+        "{% if record.waitlist_position %}"
+        "<button class='btn btn-default btn-xs' name='leave' value='{{record.pk}}'>Leave</button>"
+        "{% else %}"
+        "<button class='btn btn-info btn-xs' name='join' value='{{record.pk}}'>Join waitlist</button>"
+        "{% endif %}",
+        verbose_name='', orderable=False)
+
+    class Meta:
+        model = HardwareType
+        attrs = {'class': 'table table-hover'}
+        template = 'django_tables2/bootstrap-responsive.html'
+        fields = ['name', 'description', 'available', 'waitlist_count', 'position', 'action']
+        empty_text = 'Every item is available, request it instead!'
+
+
+class UtilizationTable(tables.Table):
+    name = tables.Column()
+    total_count = tables.Column(verbose_name='Items')
+    requested = tables.Column()
+    picked_up = tables.Column(verbose_name='Picked up')
+    peak_checked_out = tables.Column(verbose_name='Peak out at once')
+    peak_utilization = tables.Column(verbose_name='Peak utilization')
+    avg_loan_minutes = tables.Column(verbose_name='Average loan (min)')
+    no_show_rate = tables.Column(verbose_name='Not picked up')
+
+    def render_peak_utilization(self, value):
+        return '%d%%' % round(value * 100)
+
+    def render_no_show_rate(self, value):
+        return '%d%%' % round(value * 100)
+
+    class Meta:
+        attrs = {'class': 'table table-hover'}
+        template = 'django_tables2/bootstrap-responsive.html'
+        empty_text = 'No hardware items at all'
@@ -1,3 +1,477 @@
-# TODO
-# from django.test import TestCase
-# Create your tests here.
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from hardware.analytics import summary, rebuild_buckets
+from hardware.benchmark import seed_event, pages, page_url, fetch
+from hardware.caching import invalidate_inventory, invalidate_tab_counts, rate_limited
+from hardware.management.commands.check_hardware_query_plans import hot_querysets, explain
+from hardware.models import HardwareType, HardwareItem, Request, WaitlistEntry, UtilizationBucket
+from user.models import User
+
+# Most queries any hardware page can make
+MAX_QUERIES = 12
+
+
+@override_settings(HARDWARE_EXPIRY_SWEEP_INTERVAL=None)
+class QueryCountTests(TestCase):
+    """Every hardware page makes the same number of queries however many rows it lists"""
+
+    def measure(self, requests_per_hacker, prefix):
+        seed = seed_event(types=60, hackers=60, requests_per_hacker=requests_per_hacker, prefix=prefix)
+        # Cached tab counts and inventory of a previous seed would hide their queries
+        invalidate_inventory(None)
+        invalidate_tab_counts(None, user_ids=[seed.admin.pk] + seed.hacker_ids)
+        counts = {}
+        for name, kwargs, query, as_admin in pages(seed):
+            self.client.force_login(seed.admin if as_admin else seed.hacker)
+            with CaptureQueriesContext(connection) as queries:
+                response = fetch(self.client, page_url(name, kwargs, query))
+            self.assertEqual(response.status_code, 200, name)
+            counts[name] = (len(queries.captured_queries), response.streaming)
+        return counts
+
+    def test_fixed_query_counts(self):
+        small = self.measure(4, 'small')
+        large = self.measure(50, 'large')
+        for name, (count, streaming) in small.items():
+            # Streamed pages read their rows in chunks, one query each
+            if not streaming:
+                self.assertEqual(large[name][0], count, '%s grows with the rows' % name)
+            self.assertLessEqual(count, MAX_QUERIES, '%s is over the budget' % name)
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'Query plans are only checked on PostgreSQL and SQLite')
+class QueryPlanTests(TestCase):
+    """The hot request queries are served by an index instead of scanning the whole table"""
+
+    def test_hot_queries_use_an_index(self):
+        for name, queryset in hot_querysets():
+            plan, full_scan = explain(queryset)
+            self.assertFalse(full_scan, '%s scans the requests table:\n%s' % (name, '\n'.join(plan)))
+
+
+@override_settings(HARDWARE_EXPIRY_SWEEP_INTERVAL=None)
+class HardwareTestCase(TestCase):
+    """A hardware admin and three hackers, with helpers to create types and requests"""
+
+    def setUp(self):
+        # Rate limits and cached counts are kept by user id, which can be reused once a test is rolled back
+        cache.clear()
+        self.admin = User.objects.create_user('admin@hardware.test', 'Admin', None)
+        self.admin.is_hardware_admin = True
+        self.admin.save()
+        self.hackers = [User.objects.create_user('hacker%d@hardware.test' % i, 'Hacker %d' % i, None)
+                        for i in range(3)]
+
+    def make_type(self, total_count=3, **kwargs):
+        return HardwareType.objects.create(name='Type %d' % HardwareType.objects.count(),
+                                           description='Test hardware', total_count=total_count, **kwargs)
+
+    def make_requests(self, hw, user, amount=1):
+        """Requests amount items of the type for the user, returns their ids"""
+        self.assertEqual(hw.request_many(user, amount), (amount, 0))
+        return list(Request.objects.filter(type=hw, requestor=user).order_by('-pk')
+                    .values_list('pk', flat=True)[:amount])
+
+    def expire(self, ids):
+        """Makes the requests overdue, without expiring them"""
+        Request.objects.filter(pk__in=ids).update(
+            created_at=timezone.now() - timedelta(minutes=settings.HARDWARE_REQUEST_TIME + 1))
+
+    def assertCountersInSync(self):
+        for hw in HardwareType.objects.with_request_counts():
+            self.assertEqual((hw.reserved_count, hw.checked_out_count),
+                             (hw.counted_reserved, hw.counted_checked_out), hw.name)
+
+
+class BulkTransitionTests(HardwareTestCase):
+    """Requests are picked up, returned and cancelled in batches, leaving the ones with errors untouched"""
+
+    def test_pickup_and_return(self):
+        hw = self.make_type()
+        ids = self.make_requests(hw, self.hackers[0], 2)
+        self.assertEqual(Request.bulk_pickup(ids, self.admin), {})
+        self.assertEqual(Request.objects.filter(pk__in=ids, pickup_time__isnull=False, borrowed_by=self.admin).count(),
+                         2)
+        self.assertEqual(Request.bulk_return(ids, self.admin), {})
+        self.assertEqual(Request.objects.filter(pk__in=ids, return_time__isnull=False, returned_to=self.admin).count(),
+                         2)
+
+    def test_pickup_errors(self):
+        hw = self.make_type()
+        picked, overdue, pending = [self.make_requests(hw, hacker)[0] for hacker in self.hackers]
+        Request.bulk_pickup([picked], self.admin)
+        self.expire([overdue])
+        self.assertEqual(Request.bulk_pickup([picked], self.admin), {hw.name: 'Request has been picked up already!'})
+        self.assertEqual(Request.bulk_pickup([overdue], self.admin), {hw.name: 'Request has expired!'})
+        self.assertFalse(Request.objects.get(pk=overdue).pickup_time)
+
+        # Stock lowered below the requests by hand
+        HardwareType.objects.filter(pk=hw.pk).update(total_count=1)
+        self.assertEqual(Request.bulk_pickup([pending], self.admin), {hw.name: 'No items available'})
+        self.assertFalse(Request.objects.get(pk=pending).pickup_time)
+
+    def test_pickup_checks_stock_per_batch(self):
+        hw = self.make_type(total_count=2)
+        ids = self.make_requests(hw, self.hackers[0], 2)
+        HardwareType.objects.filter(pk=hw.pk).update(total_count=1)
+        self.assertEqual(Request.bulk_pickup(ids, self.admin), {hw.name: 'No items available'})
+        self.assertEqual(Request.objects.filter(pk__in=ids, pickup_time__isnull=False).count(), 1)
+
+    def test_return_errors(self):
+        hw = self.make_type()
+        pending, returned = self.make_requests(hw, self.hackers[0], 2)
+        Request.bulk_pickup([returned], self.admin)
+        Request.bulk_return([returned], self.admin)
+        self.assertEqual(Request.bulk_return([pending], self.admin), {hw.name: 'Request has not been picked up yet'})
+        self.assertEqual(Request.bulk_return([returned], self.admin), {hw.name: 'Request has been returned already!'})
+        self.assertFalse(Request.objects.get(pk=pending).return_time)
+
+    def test_cancel(self):
+        hw = self.make_type()
+        pending, picked, overdue = [self.make_requests(hw, hacker)[0] for hacker in self.hackers]
+        Request.bulk_pickup([picked], self.admin)
+        self.expire([overdue])
+        self.assertEqual(Request.bulk_cancel([picked]), {hw.name: 'Item has been picked up'})
+        self.assertEqual(Request.bulk_cancel([overdue]), {hw.name: 'Item has expired'})
+        self.assertEqual(Request.bulk_cancel([pending]), {})
+        self.assertEqual(set(Request.objects.values_list('pk', flat=True)), {picked, overdue})
+
+
+class RequestManyTests(HardwareTestCase):
+    """Several items of a type are requested at once, granting as many as there are available"""
+
+    def test_granted_and_denied(self):
+        hw = self.make_type(total_count=3)
+        self.assertEqual(hw.request_many(self.hackers[0], 2), (2, 0))
+        self.assertEqual(hw.request_many(self.hackers[1], 2), (1, 1))
+        self.assertEqual(hw.request_many(self.hackers[2], 1), (0, 1))
+        self.assertEqual(Request.objects.filter(type=hw).count(), 3)
+        self.assertEqual(HardwareType.objects.get(pk=hw.pk).available_count, 0)
+
+    def test_nothing_requested(self):
+        hw = self.make_type()
+        self.assertEqual(hw.request_many(self.hackers[0], 0), (0, 0))
+        self.assertEqual(hw.request_many(self.hackers[0], -2), (0, 0))
+        self.assertFalse(Request.objects.exists())
+
+    def test_view(self):
+        hws = [self.make_type(total_count=1), self.make_type(total_count=2)]
+        self.client.force_login(self.hackers[0])
+        response = self.client.post('%s?selected=%d&selected=%d' % (reverse('hw_selectamount'), hws[0].pk, hws[1].pk),
+                                    {'amount_%d' % hws[0].pk: '2', 'amount_%d' % hws[1].pk: '2'})
+        self.assertRedirects(response, reverse('hw_request'), fetch_redirect_response=False)
+        self.assertEqual(Request.objects.filter(type=hws[0]).count(), 1)
+        self.assertEqual(Request.objects.filter(type=hws[1]).count(), 2)
+
+
+class StockCounterTests(HardwareTestCase):
+    """The stock counters of each type stay equal to what its request rows count"""
+
+    def test_every_transition(self):
+        hw = self.make_type(total_count=5)
+        other = self.make_type()
+        self.assertIsNotNone(hw.request(self.hackers[0]))
+        self.assertCountersInSync()
+        ids = self.make_requests(hw, self.hackers[1], 3) + self.make_requests(other, self.hackers[1])
+        self.assertCountersInSync()
+        Request.bulk_pickup(ids[:2] + ids[3:], self.admin)
+        self.assertCountersInSync()
+        Request.bulk_return(ids[:1], self.admin)
+        self.assertCountersInSync()
+        Request.bulk_cancel(ids[2:3])
+        self.assertCountersInSync()
+        self.expire(Request.pending_objects(self.hackers[0].pk).values_list('pk', flat=True))
+        self.assertEqual(Request.expire_overdue(), 1)
+        self.assertCountersInSync()
+        hw = HardwareType.objects.get(pk=hw.pk)
+        self.assertEqual((hw.reserved_count, hw.checked_out_count, hw.available_count), (0, 1, 4))
+
+    def test_expire_overdue_in_batches(self):
+        hws = [self.make_type(total_count=5), self.make_type(total_count=5)]
+        ids = []
+        for hw in hws:
+            for hacker in self.hackers:
+                ids += self.make_requests(hw, hacker)
+        fresh = self.make_requests(hws[0], self.hackers[0])
+        self.expire(ids)
+        self.assertEqual(Request.expire_overdue(type_ids=[hws[1].pk], batch_size=2), 3)
+        self.assertEqual(Request.expire_overdue(batch_size=2), 3)
+        self.assertEqual(Request.expire_overdue(batch_size=2), 0)
+        self.assertEqual(Request.objects.filter(pk__in=ids, expired_at__isnull=False).count(), 6)
+        self.assertFalse(Request.objects.get(pk=fresh[0]).expired_at)
+        self.assertCountersInSync()
+
+    def test_rebuild(self):
+        hw = self.make_type(total_count=1)
+        self.make_requests(hw, self.hackers[0])
+        self.assertIsNone(WaitlistEntry.join(self.hackers[1], hw))
+        # Deleted by hand, leaving the item reserved
+        Request.objects.filter(requestor=self.hackers[0]).delete()
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_hardware_counters', check=True, stdout=out)
+        call_command('rebuild_hardware_counters', stdout=out)
+        self.assertCountersInSync()
+        # The item freed goes to the hacker waiting for it
+        self.assertEqual(Request.pending_objects(self.hackers[1].pk).filter(type=hw).count(), 1)
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+
+class LimitTests(HardwareTestCase):
+    """Hackers can't hold more items than their limits, nor submit requests faster than the rate"""
+
+    @override_settings(HARDWARE_MAX_OUTSTANDING=3)
+    def test_max_outstanding(self):
+        hws = [self.make_type(), self.make_type()]
+        self.assertEqual(hws[0].request_many(self.hackers[0], 2), (2, 0))
+        self.assertEqual(hws[1].request_many(self.hackers[0], 2), (1, 1))
+        self.assertIsNone(hws[1].request(self.hackers[0]))
+        # Returned items don't count
+        ids = list(Request.objects.filter(type=hws[0]).values_list('pk', flat=True))
+        Request.bulk_pickup(ids, self.admin)
+        Request.bulk_return(ids[:1], self.admin)
+        self.assertIsNotNone(hws[1].request(self.hackers[0]))
+
+    @override_settings(HARDWARE_MAX_PER_TYPE=2)
+    def test_max_per_type(self):
+        hw, capped = self.make_type(), self.make_type(max_per_user=1)
+        self.assertEqual(hw.request_many(self.hackers[0], 3), (2, 1))
+        self.assertEqual(capped.request_many(self.hackers[0], 3), (1, 2))
+        self.assertEqual(capped.request_many(self.hackers[1], 1), (1, 0))
+
+    @override_settings(HARDWARE_REQUEST_RATE=(2, 60))
+    def test_rate_limited(self):
+        self.assertFalse(rate_limited(self.hackers[0].pk))
+        self.assertFalse(rate_limited(self.hackers[0].pk))
+        self.assertTrue(rate_limited(self.hackers[0].pk))
+        self.assertFalse(rate_limited(self.hackers[1].pk))
+        with override_settings(HARDWARE_REQUEST_RATE=None):
+            self.assertFalse(rate_limited(self.hackers[0].pk))
+
+    @override_settings(HARDWARE_REQUEST_RATE=(1, 30))
+    def test_rate_limited_view(self):
+        hw = self.make_type()
+        self.client.force_login(self.hackers[0])
+        url = '%s?selected=%d' % (reverse('hw_selectamount'), hw.pk)
+        self.client.post(url, {'amount_%d' % hw.pk: '1'})
+        response = self.client.post(url, {'amount_%d' % hw.pk: '1'})
+        self.assertEqual([str(m) for m in get_messages(response.wsgi_request)],
+                         ['Too many hardware requests, wait 30 seconds before trying again'])
+        self.assertEqual(Request.objects.filter(type=hw).count(), 1)
+
+
+class WaitlistTests(HardwareTestCase):
+    """Hackers waiting for a type out of stock get its items as they are freed, in order"""
+
+    def waiting(self, hw):
+        return list(WaitlistEntry.objects.filter(type=hw).order_by('pk').values_list('user_id', flat=True))
+
+    def pending(self, hw, hacker):
+        return Request.pending_objects(hacker.pk).filter(type=hw).count()
+
+    def test_join(self):
+        hw = self.make_type(total_count=1)
+        self.assertEqual(WaitlistEntry.join(self.hackers[1], hw), 'There are items available, request them instead')
+        self.make_requests(hw, self.hackers[0])
+        self.assertIsNone(WaitlistEntry.join(self.hackers[1], hw))
+        self.assertEqual(WaitlistEntry.join(self.hackers[1], hw), 'You are already waiting for it')
+        self.assertIsNone(WaitlistEntry.join(self.hackers[2], hw))
+        self.assertEqual(WaitlistEntry.position(self.hackers[2].pk, hw.pk), 2)
+        with override_settings(HARDWARE_MAX_OUTSTANDING=1):
+            self.assertEqual(WaitlistEntry.join(self.hackers[0], hw), 'You have reached your hardware limit')
+
+    def test_promote_in_order(self):
+        hw = self.make_type(total_count=2)
+        picked, cancelled = self.make_requests(hw, self.hackers[0], 2)
+        WaitlistEntry.join(self.hackers[1], hw)
+        WaitlistEntry.join(self.hackers[2], hw)
+        Request.bulk_cancel([cancelled])
+        self.assertEqual((self.pending(hw, self.hackers[1]), self.pending(hw, self.hackers[2])), (1, 0))
+        Request.bulk_pickup([picked], self.admin)
+        Request.bulk_return([picked], self.admin)
+        self.assertEqual(self.pending(hw, self.hackers[2]), 1)
+        self.assertEqual(self.waiting(hw), [])
+        self.assertCountersInSync()
+
+    def test_promote_on_expiry(self):
+        hw = self.make_type(total_count=1)
+        ids = self.make_requests(hw, self.hackers[0])
+        WaitlistEntry.join(self.hackers[1], hw)
+        self.expire(ids)
+        Request.expire_overdue()
+        self.assertEqual(self.pending(hw, self.hackers[1]), 1)
+        self.assertCountersInSync()
+
+    @override_settings(HARDWARE_MAX_OUTSTANDING=1)
+    def test_skip_at_limit(self):
+        hw, other = self.make_type(total_count=1), self.make_type()
+        ids = self.make_requests(hw, self.hackers[0])
+        WaitlistEntry.join(self.hackers[1], hw)
+        WaitlistEntry.join(self.hackers[2], hw)
+        # Reaches the limit while waiting
+        self.make_requests(other, self.hackers[1])
+        Request.bulk_cancel(ids)
+        self.assertEqual((self.pending(hw, self.hackers[1]), self.pending(hw, self.hackers[2])), (0, 1))
+        # Keeps their place
+        self.assertEqual(self.waiting(hw), [self.hackers[1].pk])
+
+    def test_limits_per_type(self):
+        hws = [self.make_type(total_count=1, max_per_user=1), self.make_type(total_count=1, max_per_user=1)]
+        ids = [self.make_requests(hw, self.hackers[0])[0] for hw in hws]
+        for hw in hws:
+            WaitlistEntry.join(self.hackers[1], hw)
+        Request.bulk_cancel(ids)
+        # An item of one type doesn't count against the limit of the other
+        self.assertEqual([self.pending(hw, self.hackers[1]) for hw in hws], [1, 1])
+
+    def test_restock(self):
+        hw = self.make_type(total_count=1)
+        self.make_requests(hw, self.hackers[0])
+        WaitlistEntry.join(self.hackers[1], hw)
+        WaitlistEntry.join(self.hackers[2], hw)
+        hw = HardwareType.objects.get(pk=hw.pk)
+        hw.total_count = 2
+        hw.save()
+        self.assertEqual((self.pending(hw, self.hackers[1]), self.pending(hw, self.hackers[2])), (1, 0))
+        self.assertEqual(self.waiting(hw), [self.hackers[2].pk])
+        self.assertCountersInSync()
+
+    @override_settings(HARDWARE_MAX_OUTSTANDING=5)
+    def test_promote_queries(self):
+        hackers = [User.objects.create_user('waiter%d@hardware.test' % i, 'Waiter %d' % i, None) for i in range(10)]
+        counts = []
+        for waiters in (hackers[:2], hackers[2:]):
+            hw = self.make_type(total_count=1)
+            ids = self.make_requests(hw, self.hackers[0])
+            for hacker in waiters:
+                WaitlistEntry.join(hacker, hw)
+            with CaptureQueriesContext(connection) as queries:
+                Request.bulk_cancel(ids)
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_view_rejects_bad_ids(self):
+        self.client.force_login(self.hackers[0])
+        for data in ({'join': 'x'}, {'leave': 'x'}, {'join': '999'}):
+            response = self.client.post(reverse('hw_waitlist'), data)
+            self.assertRedirects(response, reverse('hw_waitlist'), fetch_redirect_response=False)
+            # Messages are kept until a page shows them
+            self.assertEqual(set(str(m) for m in get_messages(response.wsgi_request)), {'Unknown hardware item'})
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+
+class ItemTrackingTests(HardwareTestCase):
+    """Units are handed out and returned by their code once a type tracks every one of them"""
+
+    def make_tracked_type(self, codes):
+        hw = self.make_type(total_count=len(codes))
+        for code in codes:
+            HardwareItem.objects.create(type=hw, code=code)
+        return HardwareType.objects.get(pk=hw.pk)
+
+    def test_total_follows_items_once_tracked(self):
+        hw = self.make_type(total_count=3)
+        self.make_requests(hw, self.hackers[0], 2)
+        HardwareItem.objects.create(type=hw, code='A1')
+        hw = HardwareType.objects.get(pk=hw.pk)
+        self.assertEqual((hw.total_count, hw.tracks_items), (3, False))
+        for code in ('A2', 'A3', 'A4'):
+            HardwareItem.objects.create(type=hw, code=code)
+        hw = HardwareType.objects.get(pk=hw.pk)
+        self.assertEqual((hw.total_count, hw.tracks_items), (4, True))
+
+        HardwareItem.objects.get(code='A4').delete()
+        self.assertEqual(HardwareType.objects.get(pk=hw.pk).total_count, 3)
+        HardwareItem.objects.get(code='A3').delete()
+        # Two items are requested
+        with self.assertRaises(ValidationError):
+            with transaction.atomic():
+                HardwareItem.objects.get(code='A2').delete()
+        self.assertEqual(HardwareType.objects.get(pk=hw.pk).total_count, 2)
+
+    def test_pickup_codes(self):
+        hw = self.make_tracked_type(['A1', 'A2', 'A3'])
+        other = self.make_tracked_type(['B1'])
+        ids = self.make_requests(hw, self.hackers[0], 3)
+        self.assertEqual(Request.bulk_pickup(ids[:1], self.admin), {hw.name: 'Scan the item code'})
+        self.assertEqual(Request.bulk_pickup(ids[:1], self.admin, codes={ids[0]: 'NOPE'}),
+                         {hw.name: 'Unknown item NOPE'})
+        self.assertEqual(Request.bulk_pickup(ids[:1], self.admin, codes={ids[0]: 'B1'}),
+                         {hw.name: 'Item B1 is of another type'})
+        self.assertEqual(Request.bulk_pickup(ids[:2], self.admin, codes={ids[0]: 'A1', ids[1]: 'A1'}),
+                         {hw.name: 'Item A1 is already out'})
+        self.assertEqual(Request.objects.filter(pk__in=ids, pickup_time__isnull=False).count(), 1)
+        picked = Request.objects.get(pk__in=ids, pickup_time__isnull=False)
+        self.assertEqual(picked.item.code, 'A1')
+        rest = [pk for pk in ids if pk != picked.pk]
+        self.assertEqual(Request.bulk_pickup(rest[:1], self.admin, codes={str(rest[0]): 'A1'}),
+                         {hw.name: 'Item A1 is already out'})
+        codes = {str(pk): code for pk, code in zip(rest, ['A2', 'A3'])}
+        self.assertEqual(Request.bulk_pickup(rest, self.admin, codes=codes), {})
+        self.assertFalse(other.requests.exists())
+        self.assertCountersInSync()
+
+    def test_return_by_code(self):
+        hw = self.make_tracked_type(['A1'])
+        ids = self.make_requests(hw, self.hackers[0])
+        Request.bulk_pickup(ids, self.admin, codes={ids[0]: 'A1'})
+        self.assertEqual(Request.open_loan('A1').pk, ids[0])
+
+        self.client.force_login(self.admin)
+        for code, message in (('', 'Scan an item code'), ('A1', '%s A1 returned by Hacker 0' % hw.name),
+                              ('A1', 'Item A1 is not out')):
+            response = self.client.post(reverse('hw_item_return'), {'code': code}, follow=True)
+            self.assertIn(message, [str(m) for m in response.context['messages']])
+        self.assertIsNone(Request.open_loan('A1'))
+        self.assertTrue(Request.objects.get(pk=ids[0]).return_time)
+
+
+class UtilizationTests(HardwareTestCase):
+    """Rollups kept by the live transitions match the ones rebuilt from the requests"""
+
+    def activity(self):
+        hw, other = self.make_type(total_count=5), self.make_type()
+        ids = self.make_requests(hw, self.hackers[0], 3) + self.make_requests(other, self.hackers[1], 2)
+        Request.bulk_pickup(ids[:2] + ids[3:4], self.admin)
+        Request.objects.filter(pk__in=ids[:1]).update(pickup_time=timezone.now() - timedelta(minutes=30))
+        Request.bulk_return(ids[:1], self.admin)
+        Request.bulk_cancel(ids[4:])
+        self.expire(ids[2:3])
+        Request.expire_overdue()
+        return hw, other
+
+    def test_record(self):
+        hw, other = self.activity()
+        rows = {row['id']: row for row in summary()}
+        self.assertEqual({field: rows[hw.pk][field] for field in UtilizationBucket.COUNTERS + ['peak_checked_out']},
+                         {'requested': 3, 'picked_up': 2, 'returned': 1, 'expired': 1, 'cancelled': 0,
+                          'loan_seconds': rows[hw.pk]['loan_seconds'], 'peak_checked_out': 2})
+        self.assertAlmostEqual(rows[hw.pk]['avg_loan_minutes'], 30, delta=1)
+        self.assertEqual((rows[other.pk]['requested'], rows[other.pk]['cancelled']), (2, 1))
+
+    def test_rebuild_matches_record(self):
+        self.activity()
+        live = summary()
+        self.assertTrue(rebuild_buckets())
+        self.assertEqual(summary(), live)
+
+    def test_bad_periods(self):
+        self.client.force_login(self.admin)
+        for hours in ('nan', 'inf', '-inf', '1e10', '-1', '0', 'x', '2'):
+            response = self.client.get(reverse('hw_analytics_api'), {'hours': hours})
+            self.assertEqual(response.status_code, 200, hours)
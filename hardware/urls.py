@@ -5,13 +5,22 @@ from hardware import views
 urlpatterns = [
     url(r'^$', views.root_view, name='hw_root'),
     url(r'^api/$', views.hardware_api, name='hw_api'),
+    url(r'^api/stream/$', views.hardware_stream, name='hw_stream'),
     url(r'^list/$', views.HardwareAvailableView.as_view(), name='hw_list'),
     url(r'^request/$', views.HackerCurrentRequestView.as_view(), name='hw_request'),
     url(r'^active/$', views.HackerCurrentActiveView.as_view(), name='hw_active'),
+    url(r'^waitlist/$', views.HardwareWaitlistView.as_view(), name='hw_waitlist'),
     url(r'^list/amount$', views.HardwareSelectAmountView.as_view(), name='hw_selectamount'),
     url(r'^hacker/$', views.HardwarePickUpReturnView.as_view(), name='hw_pickupreturn'),
+    url(r'^hacker/lookup/$', views.HackerLookupView.as_view(), name='hw_lookup'),
+    url(r'^hacker/scan/$', views.HackerScanView.as_view(), name='hw_scan'),
+    url(r'^items/return/$', views.ItemReturnView.as_view(), name='hw_item_return'),
     url(r'^all/$', views.HardwareAvailableAdmin.as_view(), name='hw_listall'),
     url(r'^active/all/$', views.HardwareActiveAdmin.as_view(), name='hwad_active'),
+    url(r'^export/$', views.LoanExportView.as_view(), name='hw_export'),
+    url(r'^analytics/$', views.UtilizationView.as_view(), name='hw_analytics'),
+    url(r'^analytics/api/$', views.UtilizationApiView.as_view(), name='hw_analytics_api'),
+    url(r'^stats/$', views.InstrumentationStatsView.as_view(), name='hw_stats'),
     url(r'^hacker/(?P<id>[\w-]+)/return/$', views.HackerReturnView.as_view(), name='hw_return'),
     url(r'^hacker/(?P<id>[\w-]+)/pickup/$', views.HackerPickupView.as_view(), name='hw_pickup'),
     url(r'^hacker/(?P<id>[\w-]+)/$', views.RequestsHistoricView.as_view(), name='hw_requestor'),
@@ -1,24 +1,43 @@
+import logging
+import time
+from datetime import timedelta
+
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.exceptions import ValidationError
-from django.http import HttpResponseRedirect, JsonResponse
+from django.db.models import Q
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.utils import timezone
-from django.views.decorators.cache import cache_page
-from django.views.generic import TemplateView
+from django.views.decorators.http import condition
+from django.views.generic import TemplateView, View
 from django_filters.views import FilterView
 from django_tables2 import SingleTableMixin
 
 from app.mixins import TabsViewMixin
-from hardware.models import Request, HardwareType
+from hardware.analytics import summary, series
+from hardware.caching import tab_counts, inventory, rate_limited, request_rate
+from hardware.events import get_broker, format_event
+from hardware.export import FORMATS, loan_rows
+from hardware.instrumentation import stats, enabled as instrumentation_enabled
+from hardware.lookup import hackers, hacker_index, find_user
+from hardware.mixins import KeysetPaginationMixin
+from hardware.models import Request, HardwareType, WaitlistEntry, UtilizationBucket
 from hardware.tables import RequestorTable, RequestorFilter, PickupTable, ReturnTable, RequestsTable, \
     AvailableHardwareTable, SelectCountHardwareTable, HackerRequests, HackerActive, HackerAvailableHardwareTable, \
-    ActiveHardwareTable, HardwareTypeFilter, RequestFilter, HackerAvailableHardwareTableSelect
+    ActiveHardwareTable, HardwareTypeFilter, RequestFilter, HackerAvailableHardwareTableSelect, WaitlistTable, \
+    UtilizationTable
 from user.mixins import IsHardwareAdminMixin
 from user.models import User
 
+logger = logging.getLogger(__name__)
+
+# Seconds between keepalive comments on idle event streams
+STREAM_KEEPALIVE = 15
+# Longest period the analytics can be asked for, in hours
+ANALYTICS_MAX_HOURS = 24 * 365
+
 
 @login_required
 def root_view(request):
@@ -29,35 +48,77 @@ def root_view(request):
         return HttpResponseRedirect(reverse('hw_list'))
 
 
-@cache_page(60)
+def _inventory(request):
+    # The snapshot is needed three times per request, by the conditional checks and the view
+    if not hasattr(request, '_hw_inventory'):
+        request._hw_inventory = inventory()
+    return request._hw_inventory
+
+
+@condition(etag_func=lambda request: _inventory(request)['etag'],
+           last_modified_func=lambda request: _inventory(request)['update_time'])
 def hardware_api(request):
-    hws = HardwareType.prefetch_objects().all()
-    ret = [{'name': hw.name, 'description': hw.description, 'total': hw.total_count, 'url': hw.url,
-            'available': hw.available_count}
-           for hw in hws]
-    r = JsonResponse({'items': ret, 'update_time': timezone.now()})
+    snapshot = _inventory(request)
+    r = JsonResponse({'items': snapshot['items'], 'update_time': snapshot['update_time']})
     r._headers.update({'access': ('Access-Control-Allow-Origin', '*')})
     return r
 
 
+def hardware_stream(request):
+    """
+    Server-sent events with the availability of the types as they change, and the reservations of the hacker
+    logged in. Starts with a full inventory snapshot.
+    """
+    broker = get_broker()
+    user_id = request.user.pk if request.user.is_authenticated else None
+
+    def stream():
+        # Subscribed once the body is read, a response never iterated (e.g. HEAD) would leak its subscription
+        subscription = broker.subscribe(user_id)
+        try:
+            yield format_event('inventory', inventory()['items'])
+            while True:
+                event = subscription.get(timeout=STREAM_KEEPALIVE)
+                # Comments keep proxies from closing idle connections
+                yield format_event(*event) if event else ': keepalive\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+
+    r = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    r['Cache-Control'] = 'no-cache'
+    r['X-Accel-Buffering'] = 'no'
+    return r
+
+
+def rate_limited_message():
+    """Error shown to hackers over HARDWARE_REQUEST_RATE, with its window in the largest whole unit"""
+    count, unit = int(request_rate()[1]), 'second'
+    for size, name in ((3600, 'hour'), (60, 'minute')):
+        if count >= size and count % size == 0:
+            count, unit = count // size, name
+            break
+    return 'Too many hardware requests, wait %d %s%s before trying again' % (count, unit, '' if count == 1 else 's')
+
+
 def hardware_admin_tabs():
     return [
         ('Pick up/Return', reverse('hw_pickupreturn'), False),
         ('Available', reverse('hw_listall'), False),
         ('Active', reverse('hwad_active'), False),
+        ('Analytics', reverse('hw_analytics'), False),
     ]
 
 
 def hardware_hacker_tabs(user):
     l = [
         ('Available', reverse('hw_list'), False),
+        ('Waitlist', reverse('hw_waitlist'), False),
     ]
-    count = Request.pending_objects(user).count()
-    if count:
-        l.append(('Requested', reverse('hw_request'), count), )
-    active = Request.active_objects(user).count()
-    if active:
-        l.append(('Active', reverse('hw_active'), active), )
+    counts = tab_counts(user.pk)
+    if counts['pending']:
+        l.append(('Requested', reverse('hw_request'), counts['pending']), )
+    if counts['active']:
+        l.append(('Active', reverse('hw_active'), counts['active']), )
     return l
 
 
@@ -73,7 +134,48 @@ class HardwarePickUpReturnView(TabsViewMixin, IsHardwareAdminMixin, SingleTableM
         return hardware_admin_tabs()
 
     def get_queryset(self):
-        return User.objects.filter(is_volunteer=False, is_director=False, is_active=True, is_organizer=False)
+        return hackers()
+
+
+class HackerLookupView(IsHardwareAdminMixin, View):
+    """Hackers matching the query by name or email prefix, for the desk typeahead"""
+
+    def get(self, request, *args, **kwargs):
+        start = time.time()
+        try:
+            limit = min(int(request.GET.get('limit', 10)), 50)
+        except ValueError:
+            limit = 10
+        results = hacker_index().search(request.GET.get('q', ''), limit)
+        took_ms = (time.time() - start) * 1000
+        if took_ms > getattr(settings, 'HARDWARE_LOOKUP_BUDGET_MS', 50):
+            logger.warning('Hacker lookup took %.1fms', took_ms)
+        return JsonResponse({'results': results, 'took_ms': round(took_ms, 2)})
+
+
+class HackerScanView(IsHardwareAdminMixin, View):
+    """Hacker identified by a scanned code with their pending and active requests, in a single payload"""
+
+    def get(self, request, *args, **kwargs):
+        user = find_user(request.GET.get('code', ''))
+        if not user:
+            return JsonResponse({'error': 'Hacker not found'}, status=404)
+        pending, active = [], []
+        for r in Request.open_objects(user.pk).select_related('type'):
+            if r.pickup_time:
+                active.append({'id': r.pk, 'name': r.type.name, 'pickup_time': r.pickup_time})
+            else:
+                pending.append({'id': r.pk, 'name': r.type.name, 'expires_at': r.expires_at})
+        return JsonResponse({
+            'user': {'id': user.pk, 'name': user.name, 'email': user.email},
+            'pending': pending,
+            'active': active,
+            'urls': {
+                'pickup': reverse('hw_pickup', kwargs={'id': user.pk}),
+                'return': reverse('hw_return', kwargs={'id': user.pk}),
+                'history': reverse('hw_requestor', kwargs={'id': user.pk}),
+            },
+        })
 
 
 class HackerPickupView(TabsViewMixin, IsHardwareAdminMixin, SingleTableMixin, TemplateView):
@@ -85,7 +187,8 @@ class HackerPickupView(TabsViewMixin, IsHardwareAdminMixin, SingleTableMixin, Te
         return reverse('hw_pickupreturn')
 
     def get_queryset(self):
-        return Request.pending_objects(user_id=self.kwargs['id']).all()
+        return Request.pending_objects(user_id=self.kwargs['id']).select_related('type') \
+            .only('created_at', 'pickup_time', 'type__name')
 
     def get_context_data(self, **kwargs):
         c = super(HackerPickupView, self).get_context_data(**kwargs)
@@ -94,13 +197,8 @@ class HackerPickupView(TabsViewMixin, IsHardwareAdminMixin, SingleTableMixin, Te
 
     def post(self, request, *args, **kwargs):
         selected = self.request.POST.getlist('selected')
-        hws = Request.objects.filter(pk__in=selected)
-        errors = {}
-        for hw in hws:
-            try:
-                hw.pickup(request.user)
-            except ValidationError as e:
-                errors[hw.type.name] = ' '.join(e.messages)
+        codes = {pk: self.request.POST.get('code_' + pk, '').strip() for pk in selected}
+        errors = Request.bulk_pickup(selected, request.user, codes=codes)
         if errors.keys():
             messages.error(request,
                            'Failed to pick up: ' + ', '.join([str(k) + ':' + str(v) for k, v in errors.items()])
@@ -122,27 +220,43 @@ class HackerReturnView(TabsViewMixin, IsHardwareAdminMixin, SingleTableMixin, Te
         return c
 
     def get_queryset(self):
-        return Request.active_objects(user_id=self.kwargs['id']).all()
+        return Request.active_objects(user_id=self.kwargs['id']).select_related('type', 'item') \
+            .only('pickup_time', 'type__name', 'item__code')
 
     def post(self, request, *args, **kwargs):
         selected = self.request.POST.getlist('selected')
-        hws = Request.objects.filter(pk__in=selected)
-        errors = {}
-        for hw in hws:
-            try:
-                hw.return_(request.user)
-            except ValidationError as e:
-                errors[hw.type.name] = ' '.join(e.messages)
+        errors = Request.bulk_return(selected, request.user)
         if errors.keys():
             messages.error(request,
                            'Failed to return: ' + ', '.join([str(k) + ':' + str(v) for k, v in errors.items()]))
         return HttpResponseRedirect(reverse('hw_requestor', kwargs=self.kwargs))
 
 
-class RequestsHistoricView(TabsViewMixin, IsHardwareAdminMixin, SingleTableMixin, TemplateView):
+class ItemReturnView(IsHardwareAdminMixin, View):
+    """Returns the unit with the scanned code from whoever has it"""
+
+    def post(self, request, *args, **kwargs):
+        code = request.POST.get('code', '').strip()
+        if not code:
+            messages.error(request, 'Scan an item code')
+            return HttpResponseRedirect(reverse('hw_pickupreturn'))
+        loan = Request.open_loan(code)
+        if not loan:
+            messages.error(request, 'Item %s is not out' % code)
+            return HttpResponseRedirect(reverse('hw_pickupreturn'))
+        errors = Request.bulk_return([loan.pk], request.user)
+        if errors.keys():
+            messages.error(request,
+                           'Failed to return: ' + ', '.join([str(k) + ':' + str(v) for k, v in errors.items()]))
+        else:
+            messages.success(request, '%s %s returned by %s' % (loan.type.name, code, loan.requestor.name))
+        return HttpResponseRedirect(reverse('hw_pickupreturn'))
+
+
+class RequestsHistoricView(TabsViewMixin, IsHardwareAdminMixin, KeysetPaginationMixin, SingleTableMixin, TemplateView):
     template_name = 'hacker_historic_view.html'
     table_class = RequestsTable
-    table_pagination = {'per_page': 50}
+    keyset = ('-id',)
 
     def get_back_url(self):
         return reverse('hw_pickupreturn')
@@ -153,7 +267,9 @@ class RequestsHistoricView(TabsViewMixin, IsHardwareAdminMixin, SingleTableMixin
         return c
 
     def get_queryset(self):
-        return Request.historic_objects(self.kwargs['id']).all()
+        return Request.historic_objects(self.kwargs['id']) \
+            .select_related('type', 'item', 'borrowed_by', 'returned_to') \
+            .only('pickup_time', 'return_time', 'type__name', 'item__code', 'borrowed_by__email', 'returned_to__email')
 
 
 class HardwareAvailableAdmin(TabsViewMixin, IsHardwareAdminMixin, SingleTableMixin, FilterView):
@@ -166,20 +282,85 @@ class HardwareAvailableAdmin(TabsViewMixin, IsHardwareAdminMixin, SingleTableMix
         return hardware_admin_tabs()
 
     def get_queryset(self):
-        return HardwareType.prefetch_objects().all()
+        return HardwareType.with_availability()
 
 
-class HardwareActiveAdmin(TabsViewMixin, IsHardwareAdminMixin, SingleTableMixin, FilterView):
+class HardwareActiveAdmin(TabsViewMixin, IsHardwareAdminMixin, KeysetPaginationMixin, SingleTableMixin, FilterView):
     template_name = 'hwadmin_active.html'
     table_class = ActiveHardwareTable
-    table_pagination = {'per_page': 50}
+    keyset = ('-pickup_time', '-id')
     filterset_class = RequestFilter
 
     def get_current_tabs(self):
         return hardware_admin_tabs()
 
     def get_queryset(self):
-        return Request.active_overall().all()
+        return Request.active_overall().select_related('type', 'requestor') \
+            .only('pickup_time', 'type__name', 'requestor__name')
+
+
+class LoanExportView(IsHardwareAdminMixin, View):
+    """Every request with its hacker, type and admins, streamed as CSV or NDJSON for reconciling lost items"""
+
+    def get(self, request, *args, **kwargs):
+        lines, content_type, extension = FORMATS.get(request.GET.get('format'), FORMATS['csv'])
+        unreturned = bool(request.GET.get('unreturned'))
+        r = StreamingHttpResponse(lines(loan_rows(unreturned)), content_type=content_type)
+        r['Content-Disposition'] = 'attachment; filename="hardware_%s.%s"' % (
+            'unreturned' if unreturned else 'loans', extension)
+        return r
+
+
+def _since(request):
+    """Start of the period given in hours by the query string, up to ANALYTICS_MAX_HOURS. None for the whole event"""
+    try:
+        hours = float(request.GET.get('hours', ''))
+    except ValueError:
+        return None
+    # Also rejects nan, which fails every comparison
+    if not 0 < hours < float('inf'):
+        return None
+    return timezone.now() - timedelta(hours=min(hours, ANALYTICS_MAX_HOURS))
+
+
+class UtilizationView(TabsViewMixin, IsHardwareAdminMixin, SingleTableMixin, TemplateView):
+    template_name = 'hwadmin_analytics.html'
+    table_class = UtilizationTable
+    table_pagination = False
+
+    def get_current_tabs(self):
+        return hardware_admin_tabs()
+
+    def get_table_data(self):
+        return summary(_since(self.request))
+
+
+class UtilizationApiView(IsHardwareAdminMixin, View):
+    """Usage of every type read from the rollups, with the buckets of the types given by id"""
+
+    def get(self, request, *args, **kwargs):
+        since = _since(request)
+        try:
+            type_ids = [int(pk) for pk in request.GET.getlist('type')]
+        except ValueError:
+            type_ids = []
+        return JsonResponse({
+            'since': since,
+            'bucket_minutes': UtilizationBucket.bucket_size().total_seconds() / 60,
+            'types': summary(since),
+            'buckets': series(type_ids, since),
+        })
+
+
+class InstrumentationStatsView(IsHardwareAdminMixin, View):
+    """Timings recorded by the instrumentation in this process, POST to reset them"""
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({'enabled': instrumentation_enabled(), 'timings': stats.snapshot()})
+
+    def post(self, request, *args, **kwargs):
+        stats.reset()
+        return JsonResponse({'enabled': instrumentation_enabled(), 'timings': {}})
 
 
 # Hacker views
@@ -204,8 +385,7 @@ class HardwareAvailableView(TabsViewMixin, LoginRequiredMixin, SingleTableMixin,
         return c
 
     def get_queryset(self):
-        hws = HardwareType.prefetch_objects().all()
-        return [h for h in hws if h.available_count > 0]
+        return HardwareType.objects.available().order_by('pk')
 
 
 class HardwareSelectAmountView(TabsViewMixin, LoginRequiredMixin, SingleTableMixin, TemplateView):
@@ -218,22 +398,27 @@ class HardwareSelectAmountView(TabsViewMixin, LoginRequiredMixin, SingleTableMix
 
     def get_queryset(self):
         selected = self.request.GET.getlist('selected')
-        hws = HardwareType.objects.filter(pk__in=selected)
-        return [h for h in hws if h.available_count > 0]
+        return HardwareType.objects.filter(pk__in=selected).available().order_by('pk')
 
     def post(self, request, *args, **kwargs):
         if not getattr(settings, 'HACKERS_CAN_REQUEST', True):
             messages.error(request, 'Hardware lab is not available at the moment!')
             return HttpResponseRedirect(reverse('hw_request'))
+        if rate_limited(request.user.pk):
+            messages.error(request, rate_limited_message())
+            return HttpResponseRedirect(reverse('hw_request'))
 
         ids = request.GET.getlist('selected')
         hws = HardwareType.objects.filter(pk__in=ids)
         errors = {}
         for hw in hws:
-            amount = int(request.POST.get('amount_' + str(hw.pk), 0))
-            for i in range(amount):
-                if not hw.request(request.user):
-                    errors[hw.type.name] = errors.get(hw.type.name, 0) + 1
+            try:
+                amount = int(request.POST.get('amount_' + str(hw.pk), 0))
+            except ValueError:
+                amount = 0
+            granted, denied = hw.request_many(request.user, amount)
+            if denied:
+                errors[hw.name] = denied
         if errors.keys():
             messages.error(request, 'Couldn\'t request the following items:' + ', '.join(
                 [str(k) + '(' + str(v) + ')' for k, v in errors.items()]
@@ -251,7 +436,8 @@ class HackerCurrentRequestView(TabsViewMixin, LoginRequiredMixin, SingleTableMix
         return hardware_hacker_tabs(self.request.user)
 
     def get_queryset(self):
-        return Request.pending_objects(self.request.user.pk).all()
+        return Request.pending_objects(self.request.user.pk).select_related('type') \
+            .only('created_at', 'pickup_time', 'type__name', 'type__description')
 
 
 class HackerCurrentActiveView(TabsViewMixin, LoginRequiredMixin, SingleTableMixin, TemplateView):
@@ -263,4 +449,46 @@ class HackerCurrentActiveView(TabsViewMixin, LoginRequiredMixin, SingleTableMixi
         return hardware_hacker_tabs(self.request.user)
 
     def get_queryset(self):
-        return Request.active_objects(self.request.user.pk).all()
+        return Request.active_objects(self.request.user.pk).select_related('type') \
+            .only('pickup_time', 'type__name', 'type__description')
+
+
+class HardwareWaitlistView(TabsViewMixin, LoginRequiredMixin, SingleTableMixin, TemplateView):
+    template_name = 'hardware_waitlist.html'
+    table_class = WaitlistTable
+    table_pagination = {'per_page': 50}
+
+    def get_current_tabs(self):
+        return hardware_hacker_tabs(self.request.user)
+
+    def get_queryset(self):
+        # Types out of stock, and those the hacker still waits for
+        waiting = WaitlistEntry.objects.filter(user_id=self.request.user.pk).values('type_id')
+        return HardwareType.objects.with_availability() \
+            .filter(Q(annotated_available_count__lte=0) | Q(pk__in=waiting)) \
+            .with_waitlist(self.request.user.pk).order_by('pk')
+
+    def post(self, request, *args, **kwargs):
+        try:
+            leave = int(request.POST['leave']) if request.POST.get('leave') else None
+            join = int(request.POST['join']) if request.POST.get('join') else None
+        except ValueError:
+            messages.error(request, 'Unknown hardware item')
+            return HttpResponseRedirect(reverse('hw_waitlist'))
+        if leave is not None:
+            WaitlistEntry.objects.filter(user_id=request.user.pk, type_id=leave).delete()
+            return HttpResponseRedirect(reverse('hw_waitlist'))
+        if not getattr(settings, 'HACKERS_CAN_REQUEST', True):
+            messages.error(request, 'Hardware lab is not available at the moment!')
+            return HttpResponseRedirect(reverse('hw_waitlist'))
+        if rate_limited(request.user.pk):
+            messages.error(request, rate_limited_message())
+            return HttpResponseRedirect(reverse('hw_waitlist'))
+        hw = HardwareType.objects.filter(pk=join).first() if join is not None else None
+        if not hw:
+            messages.error(request, 'Unknown hardware item')
+            return HttpResponseRedirect(reverse('hw_waitlist'))
+        error = WaitlistEntry.join(request.user, hw)
+        if error:
+            messages.error(request, error)
+        return HttpResponseRedirect(reverse('hw_waitlist'))